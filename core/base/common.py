@@ -12,6 +12,7 @@ CVC_PREFIX = 'cvc'
 CALC_PREFIX = 'calc'
 DATA_PREFIX = 'data'
 logger = logging.getLogger()
+_loaded_classes = {}  # Classes loaded by load_module, keyed by its arguments.
 
 def celsius_to_kelvin(temperature_in_celsius):
     """Converts temperature in Celsius to Kelvin
@@ -41,6 +42,10 @@ def load_module(module_name, class_name, package_name=None):
         class_name -- name of the class in this module
         package_name -- (optional) name of the module's package (for relative module naming)
     """
+    class_key = (module_name, class_name, package_name)
+    if class_key in _loaded_classes:  # Classes are resolved only once per process.
+        return _loaded_classes[class_key]
+
     relative_shift = '' if package_name is None else '.'*len(package_name.split('.'))
     load_module_name = relative_shift + module_name
     try:
@@ -53,6 +58,7 @@ def load_module(module_name, class_name, package_name=None):
     except ImportError:
         logger.error('Module %s does not exist', load_module_name)
         raise
+    _loaded_classes[class_key] = class_
     return class_
 
 def make_module_name(class_name):
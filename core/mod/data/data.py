@@ -10,6 +10,7 @@ from core.base.common import unlistify
 GRID_TYPE_STATION = 'station'
 GRID_TYPE_REGULAR = 'regular'
 GRID_TYPE_IRREGULAR = 'irregular'
+ROI_RADIUS = 1e-5  # Tolerance of the point-in-ROI test (degrees).
 
 class Data:
     """ Provides common methods for data access modules (classes).
@@ -20,6 +21,8 @@ class Data:
         self._read_result = {'@type': 'data'}   # Data arrays, grids and some additional information read in a child class.
         self._read_result['data'] = {}  # Contains data arrays read at each vertical level.
         self._data_by_segment = {}  # Data for each time segment for each vertical level.
+        self._ROI = None  # Region Of Interest vertices, made by _make_ROI().
+        self._ROI_masks = {}  # ROI masks by grids they were made for. Levels usually share the same grid.
 
     def _make_ROI(self):
         """ Creates region of interest for a given set of points.
@@ -38,32 +41,110 @@ class Data:
             self.logger.error('Bad longitude value (not a number) in data: %s', self._data_info['data']['@uid'])
             raise
 
-        self._ROI = [(lon, lat) for lon, lat in zip(ROI_lons, ROI_lats)]  # Region Of Interest.
+        ROI = np.column_stack((np.asarray(ROI_lons, dtype=np.float64),
+                               np.asarray(ROI_lats, dtype=np.float64)))  # Region Of Interest vertices.
+        if self._ROI is not None and np.array_equal(ROI, self._ROI):
+            return  # The same ROI is already made, keep its masks for repeated reads.
+
+        self._ROI = ROI
+        self._ROI_path = Path(self._ROI)  # ROI polygon for point-in-ROI tests.
 
         self._ROI_bounds = {'min_lon' : min(ROI_lons), 'max_lon' : max(ROI_lons),
                             'min_lat' : min(ROI_lats), 'max_lat' : max(ROI_lats)}
 
+        # Axis-aligned rectangular ROI (possibly closed by repeating the first point) coincides with its bounding box.
+        corners = {(lon, lat) for lon in (min(ROI_lons), max(ROI_lons)) for lat in (min(ROI_lats), max(ROI_lats))}
+        self._ROI_is_rectangle = len(corners) == 4 and set(zip(ROI_lons, ROI_lats)) == corners
+
+        self._ROI_masks = {}  # Masks made for the previous ROI are not valid anymore.
+
+    def _get_ROI_indices(self, grid: np.ndarray, min_value: float, max_value: float):
+        """ Finds indices of 1-D grid nodes lying within given limits.
+
+        Arguments:
+            grid -- 1-D coordinate grid (longitudes or latitudes)
+            min_value -- lower limit
+            max_value -- upper limit
+
+        Returns:
+            indices -- indices of grid nodes within limits (ndarray)
+        """
+        if grid.size > 1 and np.all(np.diff(grid) > 0):  # Increasing grid gives a contiguous range of indices.
+            start = np.searchsorted(grid, min_value, side='left')
+            stop = np.searchsorted(grid, max_value, side='right')
+            indices = np.arange(start, stop)
+        else:
+            indices = np.nonzero((grid >= min_value) & (grid <= max_value))[0]
+
+        return indices
+
+    def _get_ROI_box_mask(self, lons: np.ndarray, lats: np.ndarray):
+        """ Finds grid nodes lying within the ROI bounding box widened by the point-in-ROI test tolerance.
+
+        Arguments:
+            lons -- longitudes of grid nodes
+            lats -- latitudes of grid nodes (same shape as lons)
+
+        Returns:
+            in_box -- boolean array of the same shape, True for nodes within the box
+        """
+        return ((lons >= self._ROI_bounds['min_lon'] - ROI_RADIUS) & (lons <= self._ROI_bounds['max_lon'] + ROI_RADIUS) &
+                (lats >= self._ROI_bounds['min_lat'] - ROI_RADIUS) & (lats <= self._ROI_bounds['max_lat'] + ROI_RADIUS))
+
+    def _get_ROI_box_indices(self, lons: np.ndarray, lats: np.ndarray):
+        """ Finds rows and columns of a 2-D (irregular) grid bounding all nodes lying within the ROI bounding box.
+
+        Arguments:
+            lons -- 2-D longitude grid
+            lats -- 2-D latitude grid
+
+        Returns:
+            row_indices, column_indices -- contiguous ranges of indices (ndarray), the whole grid if no nodes are in the box
+        """
+        in_box = np.ma.filled(self._get_ROI_box_mask(lons, lats), False)
+        rows = np.flatnonzero(in_box.any(axis=1))
+        columns = np.flatnonzero(in_box.any(axis=0))
+        if rows.size == 0:
+            return np.arange(lons.shape[-2]), np.arange(lons.shape[-1])
+
+        return np.arange(rows[0], rows[-1] + 1), np.arange(columns[0], columns[-1] + 1)
+
     def _make_ROI_mask(self, lons: np.ndarray, lats: np.ndarray):
         """ Creates a 2D-mask for a given region of interest.
         Arguments:
             lons -- longitudes of the masked area
             lats -- latitudes of the masked area
         Returns:
-            mask -- 2D-mask for the area where True are masked values
+            mask -- 2D-mask for the area where True are masked values (read-only, it's shared between calls)
         """
+        # The mask is made only once for each grid, so vertical levels sharing a grid don't repeat the polygon test.
+        grids_key = tuple((grid.dtype.str, grid.shape, np.ma.getdata(grid).tobytes()) for grid in (lons, lats))
+        mask = self._ROI_masks.get(grids_key)
+        if mask is not None:
+            return mask
+
         if lons.ndim == 1:
-            lon2d, lat2d = np.meshgrid(lons, lats)
+            # Broadcast views instead of meshgrid: only coordinates of points within the ROI bounding box are copied.
             n_lats = lats.size
             n_lons = lons.size
+            lon2d = np.broadcast_to(lons[np.newaxis, :], (n_lats, n_lons))
+            lat2d = np.broadcast_to(lats[:, np.newaxis], (n_lats, n_lons))
         else:
             lon2d, lat2d = lons[:], lats[:]
-            n_lats, n_lons = lons.shape
-        lon_coords, lat_coords = lon2d.flatten(), lat2d.flatten()
-        points = np.vstack((lon_coords, lat_coords)).T
 
-        path = Path(self._ROI)
-        mask = path.contains_points(points, radius=1e-5) # True is for the points inside the ROI
-        mask = ~mask.reshape((n_lats, n_lons)) # True is masked so we need to inverse the mask
+        # Points outside the ROI bounding box can't be inside the ROI, so only points within the box
+        # are tested against the ROI polygon. For a rectangular ROI the box test is enough.
+        in_box = np.ma.filled(self._get_ROI_box_mask(lon2d, lat2d), False)
+        if self._ROI_is_rectangle:
+            mask = in_box
+        else:
+            mask = np.zeros(in_box.shape, dtype=bool)
+            if in_box.any():
+                points = np.column_stack((lon2d[in_box], lat2d[in_box]))
+                mask[in_box] = self._ROI_path.contains_points(points, radius=ROI_RADIUS) # True is for the points inside the ROI
+        mask = np.logical_not(mask, out=mask) # True is masked so we need to inverse the mask (in place)
+        mask.flags.writeable = False
+        self._ROI_masks[grids_key] = mask
 
         return mask
 
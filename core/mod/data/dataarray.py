@@ -1,6 +1,8 @@
 """Provides classes
     DataArray
 """
+import logging
+
 from core.base.common import listify
 
 from .data import Data
@@ -55,9 +57,10 @@ class DataArray(Data):
             segment = None
             for segment in segments_to_read:
                 self.logger.info('Reading time segment \'%s\'', segment['@name'])
-                self.logger.info('Min data value: %s, max data value: %s',
-                                 self._data_info['data'][level_name][segment['@name']]['@values'].min(),
-                                 self._data_info['data'][level_name][segment['@name']]['@values'].max())
+                if self.logger.isEnabledFor(logging.DEBUG):  # Statistics cost two full passes over data, so compute them only on demand.
+                    self.logger.debug('Min data value: %s, max data value: %s',
+                                      self._data_info['data'][level_name][segment['@name']]['@values'].min(),
+                                      self._data_info['data'][level_name][segment['@name']]['@values'].max())
                 self._add_segment_data(level_name=level_name,
                                        values=self._data_info['data'][level_name][segment['@name']]['@values'],
                                        time_grid=self._data_info['data'][level_name][segment['@name']]['@time_grid'],
@@ -1,16 +1,17 @@
 """Provides classes
     DataDB
 """
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
-from sqlalchemy import create_engine, MetaData, func, and_
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, MetaData, func, and_, select, bindparam
 from geoalchemy2 import *
 import numpy as np
 
 from core.base.common import listify
 from .data import Data, GRID_TYPE_STATION
 
+MAX_READ_THREADS = 8  # Maximum number of vertical levels read concurrently.
+
 class DataDb(Data):
     """ Provides methods for reading and writing geodatabase files.
     """
@@ -29,6 +30,107 @@ class DataDb(Data):
                                         self._data_info['data']['region']['point'][0]['@lat'])
         return ROI_polygon
 
+    def _read_level(self, level_name, segments_to_read, variable_name, fill_value, ROI_polygon):
+        """ Reads all time segments of a vertical level from its database.
+
+        Arguments:
+            level_name -- vertical level name
+            segments_to_read -- list of time segments
+            variable_name -- name of the variable (column) to query
+            fill_value -- fill value for missing measurements
+            ROI_polygon -- ROI as a PostGIS POLYGON string
+
+        Returns:
+            stations -- dictionary of stations metadata: codes, names, longitudes, latitudes and elevations
+        """
+
+        self.logger.info('Reading level: \'%s\'', level_name)
+        file_name_template = self._data_info['data']['levels'][level_name]['@file_name_template']
+        (db_name, _, _, _, _) = file_name_template.split('/')
+        db_url = 'postgresql://{}'.format(db_name.replace(':', '/'))
+        engine = create_engine(db_url)
+        meta = MetaData(bind=engine, reflect=True)
+        connection = engine.connect()
+
+        # Get tables objects
+        stations_tbl = meta.tables['stations']
+        st_data_tbl = meta.tables['st_data']
+
+        # ROI bounding box as a PostGIS envelope. It lets the spatial index prefilter stations before ST_Covers.
+        # The envelope takes the SRID of station locations, since '&&' fails on geometries with mixed SRIDs.
+        # The SRID subquery doesn't depend on rows, so it's evaluated once per query and the index is still used.
+        location_srid = select([func.ST_SRID(stations_tbl.columns.location)]).limit(1).as_scalar()
+        ROI_envelope = func.ST_MakeEnvelope(self._ROI_bounds['min_lon'], self._ROI_bounds['min_lat'],
+                                            self._ROI_bounds['max_lon'], self._ROI_bounds['max_lat'], location_srid)
+
+        # Form query once for all time segments. Segment dates are bound on execution.
+        # The date range is the most selective condition, so it goes first. It relies on an index
+        # on st_data.date, e.g.: CREATE INDEX IF NOT EXISTS st_data_date_brin ON st_data USING brin(date);
+        qry = select([st_data_tbl.columns[variable_name],
+                      st_data_tbl.columns.date,
+                      st_data_tbl.columns.station,
+                      stations_tbl.columns.st_name,
+                      func.ST_AsText(stations_tbl.columns.location).label('location')]).select_from(
+                          st_data_tbl.join(stations_tbl, st_data_tbl.columns.station == stations_tbl.columns.station)).where(
+                              and_(st_data_tbl.columns.date.between(bindparam('date_start'), bindparam('date_end')),
+                                   stations_tbl.columns.location.op('&&')(ROI_envelope),
+                                   func.ST_Covers(ROI_polygon, stations_tbl.columns.location.ST_AsText()))).compile(bind=engine)
+
+        # Process each time segment separately.
+        self._init_segment_data(level_name)  # Initialize a data dictionary for the vertical level 'level_name'.
+        for segment in segments_to_read:
+            self.logger.info('Reading time segment \'%s\'', segment['@name'])
+
+            # Date is stored in the PostGIS DB as integers of form YYYYMMDD.
+            # So convert string dates into integers and cut off hours.
+            date_start = int(segment['@beginning'])//100
+            date_end = int(segment['@ending'])//100
+
+            res = connection.execute(qry, date_start=date_start, date_end=date_end).fetchall()
+
+            all_stations_codes = np.array([int(st.station) for st in res])
+            all_dates = np.fromiter((st.date for st in res), dtype=np.int64, count=len(res))
+
+            # Pivot query rows into a dense (time, station) matrix in one scatter.
+            # Missing (time, station) pairs keep the fill value and are masked below.
+            stations_codes, station_first_row, station_idx = np.unique(all_stations_codes, return_index=True,
+                                                                        return_inverse=True)
+            dates, time_idx = np.unique(all_dates, return_inverse=True)
+            # Dates are integers of form YYYYMMDD. Convert them to datetime values arithmetically.
+            years, month_days = np.divmod(dates, 10000)
+            months, days = np.divmod(month_days, 100)
+            time_grid = ((years - 1970).astype('datetime64[Y]') + (months - 1).astype('timedelta64[M]') +
+                         (days - 1).astype('timedelta64[D]')).astype('datetime64[us]').tolist()
+            values = np.full((len(dates), len(stations_codes)), fill_value, dtype=np.float32)
+            values[time_idx, station_idx] = [row[0] for row in res]  # 0-th element should always reference to data values.
+
+            # Station locations and names are taken from the first row in the query response for each station.
+            n_stations = len(stations_codes)
+            longitudes = np.empty(n_stations)
+            latitudes = np.empty(n_stations)
+            elevations = np.empty(n_stations)
+            stations_names = []
+            for i, row_idx in enumerate(station_first_row):
+                station_location = res[row_idx].location.replace('(', '').replace(')', '').split(' ')
+                longitudes[i] = float(station_location[2])
+                latitudes[i] = float(station_location[3])
+                elevations[i] = float(station_location[4])
+                stations_names.append(res[row_idx].st_name)
+
+            values = np.ma.MaskedArray(values, mask=values == fill_value, fill_value=np.float32(fill_value))
+
+            self._add_segment_data(level_name=level_name, values=values, time_grid=time_grid, time_segment=segment)
+
+            # Release query rows and scatter indices before the next segment is fetched.
+            del res, all_stations_codes, all_dates, station_idx, time_idx
+
+        connection.close()
+
+        stations = {'codes': stations_codes, 'names': stations_names,
+                    'longitudes': longitudes, 'latitudes': latitudes, 'elevations': elevations}
+
+        return stations
+
     def read(self, options):
         """Queries database for in-situ measurements and puts them into an array.
 
@@ -38,7 +140,8 @@ class DataDb(Data):
                 ['levels'] -- vertical levels
 
         Returns:
-            result['array'] -- data array
+            result['array'] -- data array. Values are float32 (station measurements don't need more precision),
+                cast them if float64 is required.
         """
 
         self.logger.info('Accessing a PostGIS database...')
@@ -61,85 +164,23 @@ class DataDb(Data):
         # ROI as a POLYGON.
         ROI_polygon = self.construct_polygon()
 
-        # Process each vertical level separately.
-        for level_name in levels_to_read:
-            self.logger.info('Reading level: \'%s\'', level_name)
-            file_name_template = self._data_info['data']['levels'][level_name]['@file_name_template']
-            (db_name, _, _, _, _) = file_name_template.split('/')
-            db_url = 'postgresql://{}'.format(db_name.replace(':', '/'))
-            engine = create_engine(db_url)
-            meta = MetaData(bind=engine, reflect=True)
-            Session = sessionmaker(bind=engine)
-            session = Session()
-
-            # Get tables objects
-            stations_tbl = meta.tables['stations']
-            st_data_tbl = meta.tables['st_data']
-
-            # Process each time segment separately.
-            self._init_segment_data(level_name)  # Initialize a data dictionary for the vertical level 'level_name'.
-            for segment in segments_to_read:
-                self.logger.info('Reading time segment \'%s\'', segment['@name'])
-
-                # Date is stored in the PostGIS DB as integers of form YYYYMMDD.
-                # So convert string dates into integers and cut off hours.
-                date_start = int(segment['@beginning'])//100
-                date_end = int(segment['@ending'])//100
-
-                # Form query
-                qry = session.query(st_data_tbl.columns[variable_name],
-                                    st_data_tbl.columns.date,
-                                    st_data_tbl.columns.station,
-                                    stations_tbl.columns.st_name,
-                                    func.ST_AsText(stations_tbl.columns.location).label('location')).join(
-                                        stations_tbl, st_data_tbl.columns.station == stations_tbl.columns.station).filter(
-                                            func.ST_Covers(ROI_polygon, stations_tbl.columns.location.ST_AsText())).filter(
-                                                and_(st_data_tbl.columns.date >= date_start, st_data_tbl.columns.date <= date_end))
-
-                res = qry.all()
-                qry = None
-
-                all_stations_codes = np.array([int(st.station) for st in res])
-                stations_codes = list(set(all_stations_codes))
-
-                # Create time grid. It is the same for all stations now. So we take the first station as a source.
-                station_indices = np.where(all_stations_codes == stations_codes[0])[0]
-                time_grid = [datetime.strptime(str(res[i].date), '%Y%m%d') for i in station_indices]
-
-                values = None
-                longitudes = []
-                latitudes = []
-                elevations = []
-                stations_names = []
-                for station_code in stations_codes:
-                    # Select rows in the query response corresponding to a station WMO code
-                    station_indices = np.where(all_stations_codes == station_code)[0]
-                    # 0-th element should always reference to data values.
-                    station_values = np.ma.MaskedArray([res[i][0] for i in station_indices])
-                    values = station_values if values is None else np.vstack((values, station_values))
-                    # Station location is taken from the first row in the query response corresponding this station.
-                    station_location = res[station_indices[0]].location.replace('(', '').replace(')', '').split(' ')
-                    longitudes.append(float(station_location[2]))
-                    latitudes.append(float(station_location[3]))
-                    elevations.append(float(station_location[4]))
-                    stations_names.append(res[station_indices[0]].st_name)
-
-                values = values.transpose()
-                values.fill_value = fill_value
-                mask = values == fill_value
-                values.mask = mask
-
-                self._add_segment_data(level_name=level_name, values=values, time_grid=time_grid, time_segment=segment)
-
-            session.close()
+        # ROI bounds are used to prefilter stations by their bounding box.
+        self._make_ROI()
+
+        # Each vertical level is stored in its own database, so levels are read concurrently.
+        n_threads = max(1, min(MAX_READ_THREADS, len(levels_to_read)))
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            futures = [executor.submit(self._read_level, level_name, segments_to_read, variable_name, fill_value,
+                                       ROI_polygon) for level_name in levels_to_read]
+            stations = [future.result() for future in futures][-1]  # Stations of the last level describe the result.
 
         meta = {}
         meta['stations'] = {}
-        meta['stations']['@names'] = np.array(stations_names)
-        meta['stations']['@wmo_codes'] = np.array(stations_codes)
-        meta['stations']['@elevations'] = np.array(elevations)
+        meta['stations']['@names'] = np.array(stations['names'])
+        meta['stations']['@wmo_codes'] = np.array(stations['codes'])
+        meta['stations']['@elevations'] = np.array(stations['elevations'])
 
-        self._add_metadata(longitude_grid=np.array(longitudes), latitude_grid=np.array(latitudes),
+        self._add_metadata(longitude_grid=np.array(stations['longitudes']), latitude_grid=np.array(stations['latitudes']),
                            grid_type=GRID_TYPE_STATION, fill_value=fill_value, dimensions=('time', 'station'),
                            description=self._data_info['data']['description'], meta=meta)
 
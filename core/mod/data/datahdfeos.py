@@ -1,7 +1,9 @@
 """Provides classes
     DataHdfeos
 """
+import logging
 from string import Template
+from collections import OrderedDict
 from datetime import datetime
 
 import numpy as np
@@ -14,6 +16,7 @@ from .mfhdf import MFDataset, date2index
 NO_LEVEL_NAME = '-'
 CLASS_UNITS = ['class number']
 WILDCARDS = {'year': '????', 'mm': '??', 'year1': '????', 'year2': '????', 'year1s-4': '????', 'year2s-4': '????', 'doy': '???'}
+MFDATASET_CACHE_SIZE = 8  # Maximum number of simultaneously opened multifile datasets.
 
 class PercentTemplate(Template):
     """ Custom template for the string substitute method.
@@ -37,8 +40,38 @@ class DataHdfeos(Data):
         super().__init__(data_info)
         self._data_info = data_info
 
-        self.file_name_wildcard = ''
-        self.netcdf_root = None
+        self._hdf_roots = OrderedDict()  # Opened multifile datasets by their file name wildcards (LRU order).
+
+    def __del__(self):
+        if getattr(self, '_hdf_roots', None):  # Nothing is opened if __init__ failed.
+            self.close()
+
+    def close(self):
+        """ Closes all opened multifile datasets.
+        """
+        for hdf_root in self._hdf_roots.values():
+            hdf_root.close()
+        self._hdf_roots = OrderedDict()
+
+    def _open_dataset(self, file_name_wildcard):
+        """ Opens a multifile dataset or takes it from opened ones.
+        The least recently used dataset is closed when too many datasets are opened.
+
+        Arguments:
+            file_name_wildcard -- wildcard-ed file name template
+
+        Returns:
+            hdf_root -- opened multifile dataset
+        """
+        hdf_root = self._hdf_roots.pop(file_name_wildcard, None)
+        if hdf_root is None:  # If this is the first time we see this wildcard...
+            hdf_root = MFDataset(file_name_wildcard)
+        self._hdf_roots[file_name_wildcard] = hdf_root  # Most recently used goes to the end.
+        while len(self._hdf_roots) > MFDATASET_CACHE_SIZE:
+            _, old_hdf_root = self._hdf_roots.popitem(last=False)
+            old_hdf_root.close()
+
+        return hdf_root
 
     def read(self, options):
         """Reads HDF-EOS file into an array.
@@ -79,14 +112,9 @@ class DataHdfeos(Data):
             percent_template = PercentTemplate(file_name_template)  # Custom string template %keyword%.
             file_name_wildcard = percent_template.substitute(WILDCARDS)  # Create wildcard-ed template
 
-            # Kind of a caching for netcdf_root to save time working at the same vertical level.
+            # Opened datasets are kept by wildcard to save time on repeated reads of the same archive.
             self.logger.info('Open files...')
-            if self.file_name_wildcard != file_name_wildcard:  # If this is the first time we see this wildcard...
-                hdf_root = MFDataset(file_name_wildcard)
-                self.file_name_wildcard = file_name_wildcard  # we store wildcard...
-                self.hdf_root = hdf_root                # and netcdf_root.
-            else:
-                hdf_root = self.hdf_root  # Otherwise we take its "stored value".
+            hdf_root = self._open_dataset(file_name_wildcard)
             self.logger.info('Done!')
 
             data_variable = hdf_root.variables[self._data_info['data']['variable']['@name']]  # Data variable.
@@ -103,9 +131,8 @@ class DataHdfeos(Data):
                 lon_grid_type = GRID_TYPE_REGULAR
                 lons = longitude_variable[:]
                 if lons.max() > 180:
-                    lons = ((lons + 180.0) % 360.0) - 180.0  # Switch from 0-360 to -180-180 grid
-            longitude_indices = np.nonzero([ge and le for ge, le in
-                                            zip(lons >= self._ROI_bounds['min_lon'], lons <= self._ROI_bounds['max_lon'])])[0]
+                    lons = np.where(lons >= 180.0, lons - 360.0, lons)  # Switch from 0-360 to -180-180 grid
+            longitude_indices = self._get_ROI_indices(lons, self._ROI_bounds['min_lon'], self._ROI_bounds['max_lon'])
             variable_indices['XDim'] = longitude_indices  # longitude_indices
             longitude_grid = lons[longitude_indices]
 
@@ -114,8 +141,7 @@ class DataHdfeos(Data):
             if latitude_variable.ndim == 1:
                 lat_grid_type = GRID_TYPE_REGULAR
                 lats = latitude_variable[:]
-            latitude_indices = np.nonzero([ge and le for ge, le in
-                                           zip(lats >= self._ROI_bounds['min_lat'], lats <= self._ROI_bounds['max_lat'])])[0]
+            latitude_indices = self._get_ROI_indices(lats, self._ROI_bounds['min_lat'], self._ROI_bounds['max_lat'])
             variable_indices['YDim'] = latitude_indices  # latitude_indices
             latitude_grid = lats[latitude_indices]
 
@@ -127,7 +153,12 @@ class DataHdfeos(Data):
 
             # Determine index of the current vertical level to read data variable.
             if level_variable_name is not NO_LEVEL_NAME:
-                variable_indices[level_variable_name] = [level_variable.tolist().index(level_name)]
+                level_indices = np.flatnonzero(np.asarray(level_variable) == level_name)
+                if level_indices.size == 0:
+                    self.logger.error('Level \'%s\' is not found in level variable \'%s\'. Aborting!',
+                                      level_name, level_variable_name)
+                    raise ValueError
+                variable_indices[level_variable_name] = [int(level_indices[0])]
 
             # Get time variable
             time_variable = hdf_root.get_time_variable()
@@ -136,6 +167,7 @@ class DataHdfeos(Data):
 
             # Create ROI mask.
             ROI_mask = self._make_ROI_mask(longitude_grid, latitude_grid)
+            ROI_masks_nothing = not ROI_mask.any()  # The whole area read is within the ROI.
 
             # Process each time segment separately.
             self._init_segment_data(level_name)  # Initialize a data dictionary for the vertical level 'level_name'.
@@ -149,10 +181,11 @@ class DataHdfeos(Data):
                     self.logger.error(''' Error! The end of the time segment is before the first time in the dataset.
                             Aborting!''')
                     raise ValueError
-                variable_indices['Time'] = np.arange(time_idx_range[0], time_idx_range[1] + 1)
-                time_grid = time_variable[variable_indices['Time']]  # Time grid.
+                # Time indices are contiguous, so keep them as a range and take the time grid as a slice (a view).
+                variable_indices['Time'] = range(time_idx_range[0], time_idx_range[1] + 1)
+                time_grid = time_variable[time_idx_range[0]:time_idx_range[1] + 1]  # Time grid.
 
-                # Here we actually read the data array from the file for all lons and lats (it's faster to read everything).
+                # Here we actually read the data array from the file: a single hyperslab bounding the ROI (not the whole grid).
                 # And mask all points outside the ROI mask for all times.
                 self.logger.info('Actually reading...')
                 if data_variable.ndim == 4:
@@ -170,13 +203,19 @@ class DataHdfeos(Data):
                 # Create masks.
                 ROI_mask_time = ROI_mask
                 fill_value = data_variable._FillValue   # pylint: disable=W0212
-                fill_value_mask = data_slice == fill_value
-                combined_mask = ma.mask_or(fill_value_mask, ROI_mask_time)
+                # Build the combined mask in a single preallocated buffer.
+                combined_mask = np.empty(data_slice.shape, dtype=bool)
+                np.equal(data_slice, fill_value, out=combined_mask)
+                if not ROI_masks_nothing:  # Otherwise only fill values are masked.
+                    np.logical_or(combined_mask, ROI_mask_time, out=combined_mask)
 
                 # Create masked array using ROI mask.
                 self.logger.info('Creating masked array...')
                 masked_data_slice = ma.MaskedArray(data_slice, mask=combined_mask, fill_value=fill_value)
-                self.logger.info('Min data value: %s, max data value: %s', masked_data_slice.min(), masked_data_slice.max())
+                if self.logger.isEnabledFor(logging.DEBUG):  # Statistics cost a full pass over data, so compute them only on demand.
+                    valid_values = data_slice[~combined_mask]
+                    if valid_values.size:
+                        self.logger.debug('Min data value: %s, max data value: %s', valid_values.min(), valid_values.max())
                 self.logger.info('Done!')
 
                 self._add_segment_data(level_name=level_name, values=masked_data_slice,
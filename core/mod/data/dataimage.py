@@ -4,7 +4,6 @@
 import logging
 from copy import deepcopy
 import numpy as np
-from scipy.interpolate import griddata
 from scipy.spatial import cKDTree as KDTree
 from osgeo import gdal
 from osgeo import osr
@@ -14,6 +13,20 @@ from core.base.common import load_module, make_filename, make_raw_filename, list
 from core.base import SLDLegend
 from .data import Data
 
+# GDAL settings applied unless a user has already set them (e.g., through environment variables).
+GDAL_CONFIG_OPTIONS = {'GDAL_NUM_THREADS': 'ALL_CPUS', 'GDAL_CACHEMAX': '1024', 'GDAL_DISABLE_READDIR_ON_OPEN': 'TRUE'}
+for gdal_option, gdal_value in GDAL_CONFIG_OPTIONS.items():
+    if gdal.GetConfigOption(gdal_option) is None:
+        gdal.SetConfigOption(gdal_option, gdal_value)
+
+# Tiled and compressed GeoTIFF. DEFLATE (unlike ZSTD) is readable by any GDAL build and by Geoserver.
+# Bands are written one by one, so they are stored band-interleaved: each tile is then compressed and flushed once
+# instead of being reloaded from the block cache for every band.
+GEOTIFF_BLOCK_SIZE = 256  # Tile size (pixels). Bands are also written by strips of this many rows.
+GEOTIFF_CREATION_OPTIONS = ['TILED=YES', 'BLOCKXSIZE={}'.format(GEOTIFF_BLOCK_SIZE),
+                            'BLOCKYSIZE={}'.format(GEOTIFF_BLOCK_SIZE), 'COMPRESS=DEFLATE', 'INTERLEAVE=BAND',
+                            'NUM_THREADS=ALL_CPUS', 'BIGTIFF=IF_SAFER']
+
 class DataImage(Data):
     """ Provides reading/writing data from/to graphical files.
     Supported formats: float geoTIFF.
@@ -42,17 +55,17 @@ class DataImage(Data):
         if values.ndim == 2:  # If it is a grid, check it for uniformity.
             if ((options['longitudes'].ndim == 2) and (options['latitudes'].ndim == 2)):
                 lons = np.sort(options['longitudes'][0, :])
-                dlons = [lons[i+1] - lons[i] for i in range(len(lons)-1)]
+                dlons = np.diff(lons)
                 lats = np.sort(options['latitudes'][:, 0])
-                dlats = [lats[i+1] - lats[i] for i in range(len(lats)-1)]
+                dlats = np.diff(lats)
                 should_regrid = True
             elif ((options['longitudes'].ndim == 1) and (options['latitudes'].ndim == 1)):
                 eps = 1e-10  # Some small value. If longitude of latitudes vary more than eps, the grid is irregular.
                 lons = np.sort(options['longitudes'])
-                dlons = [lons[i+1] - lons[i] for i in range(len(lons)-1)]
+                dlons = np.diff(lons)
                 lats = np.sort(options['latitudes'])
-                dlats = [lats[i+1] - lats[i] for i in range(len(lats)-1)]
-                if ((np.std(dlons) > eps) or (np.std(dlats) > eps)):
+                dlats = np.diff(lats)
+                if ((np.ptp(dlons) > eps) or (np.ptp(dlats) > eps)):
                     should_regrid = True
                 else:
                     should_regrid = False
@@ -74,8 +87,8 @@ class DataImage(Data):
             # Create a uniform grid.
             dlon_regular = np.min(dlons) / 2.0  # Half the step to avoid a strange latitudinal shift.
             dlat_regular = np.min(dlats) / 2.0
-            nlons_regular = int(np.ceil((np.max(lons) - np.min(lons)) / dlon_regular + 1))
-            nlats_regular = int(np.ceil((np.max(lats) - np.min(lats)) / dlat_regular + 1))
+            nlons_regular = int(np.ceil((lons[-1] - lons[0]) / dlon_regular + 1))  # Grids are sorted.
+            nlats_regular = int(np.ceil((lats[-1] - lats[0]) / dlat_regular + 1))
             options_regular['longitudes'] = np.arange(nlons_regular) * dlon_regular + lons[0]
             options_regular['latitudes'] = np.arange(nlats_regular) * dlat_regular + lats[0]
 
@@ -85,17 +98,16 @@ class DataImage(Data):
             else:
                 llon, llat = options['longitudes'], options['latitudes']
             llon_regular, llat_regular = np.meshgrid(options_regular['longitudes'], options_regular['latitudes'])
-            # Interpolate.
-            interp = griddata((llon.ravel(), llat.ravel()), values.ravel(),
-                              (llon_regular.ravel(), llat_regular.ravel()), method='nearest')
+            # Interpolate (nearest neighbour). The same tree query gives distances to mask values outside original area.
+            tree = KDTree(np.column_stack((llon.ravel(), llat.ravel())))  # pylint: disable=E1102
+            dist, nearest_idx = tree.query(np.column_stack((llon_regular.ravel(), llat_regular.ravel())), k=1)
+            interp = np.ma.asarray(values).ravel()[nearest_idx]
             # Mask values outside original area.
-            tree = KDTree(np.c_[llon.ravel(), llat.ravel()])  # pylint: disable=E1102
-            dist, _ = tree.query(np.c_[llon_regular.ravel(), llat_regular.ravel()], k=1)
             lat_lims = np.asarray([44, 60, 68, 73, 76, 78, 79, 80, 81, 82, 83])  # Magic latitudes.
             i = np.searchsorted(lat_lims, np.max(llat), side='left')
             k = [0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0, 1.1, 1.2, 1.5]  # Magic coefficients.
             outliers_mask = dist > k[i]
-            combined_mask = np.ma.mask_or(outliers_mask, interp.mask, shrink=False)
+            combined_mask = np.ma.mask_or(outliers_mask, np.ma.getmaskarray(interp), shrink=False)
             interp.mask = combined_mask
             # Reshape.
             values_regular = np.reshape(interp, (nlats_regular, nlons_regular))
@@ -172,11 +184,23 @@ class ImageGeotiff():
     """ Provides reading/writing data from/to Geotiff files.
 
     """
+    # GeoTIFF driver and WGS84 geographic coordinate system are prepared once for all instances and writes.
+    _driver_name = 'GTiff'
+    _driver = gdal.GetDriverByName(_driver_name)
+    _wkt_wgs84 = osr.GetWellKnownGeogCSAsWKT('EPSG:4326')
+
     def __init__(self, data_info):
         self.logger = logging.getLogger()
         self._data_info = data_info
         self.multiband_support = True
 
+        # Check if driver supports Create() method.
+        if self._driver.GetMetadataItem(gdal.DCAP_CREATE) != 'YES':
+            self.logger.error('''Error!
+                      Driver %s does not support Create() method.
+                      Unable to write GeoTIFF.''', self._driver_name)
+            raise AssertionError
+
     def _prepare_data(self, values, options):
         """Prepares data for writing
 
@@ -185,23 +209,23 @@ class ImageGeotiff():
             options -- write options including grids
 
         Returns:
-            data, longitudes, latitudes -- prepared data and geographical grids
+            data, longitudes, latitudes, lon_split -- prepared data, geographical grids and the index of the first
+                negative longitude in data columns (0 if data don't need to be swapped)
         """
-        data = np.ma.filled(values, fill_value=values.fill_value)
+        # GeoTIFF is written as float32, so cast once here instead of letting GDAL convert it block by block.
+        data = np.ascontiguousarray(np.ma.filled(values, fill_value=values.fill_value), dtype=np.float32)
         longitudes = options['longitudes']
         latitudes = options['latitudes']
 
-        # Check if we have a (0..180,-180..0) grid and swap parts if its true.
+        # Check if we have a (0..180,-180..0) grid and swap longitudes if its true.
         # Negative should be on the left and increasing.
+        # Data parts are not swapped here to avoid copying. They are written to their places in write().
+        lon_split = 0
         if longitudes[0] > longitudes[-1]:
-            first_negative_latitude_idx = np.where(longitudes < 0)[0][0]  # It's a border between pos and neg longitudes.
-            longitudes = np.concatenate((longitudes[first_negative_latitude_idx:],
-                                         longitudes[:first_negative_latitude_idx]))
-            left_part = data[:, first_negative_latitude_idx:]
-            right_part = data[:, :first_negative_latitude_idx]
-            data = np.hstack((left_part, right_part))
+            lon_split = int(np.argmax(longitudes < 0))  # It's a border between pos and neg longitudes.
+            longitudes = np.concatenate((longitudes[lon_split:], longitudes[:lon_split]))
 
-        return data, longitudes, latitudes
+        return data, longitudes, latitudes, lon_split
 
     def read(self, options):
         """Reads Geotiff file into an array.
@@ -231,21 +255,11 @@ class ImageGeotiff():
 
         # Prepare data array with masked values replaced with a fill value.
         all_data = []
+        band_lon_splits = []  # Longitude split index for each band.
         for values, options in zip(all_values, all_options):
-            cur_data, longitudes, latitudes = self._prepare_data(values, options)
+            cur_data, longitudes, latitudes, lon_split = self._prepare_data(values, options)
             all_data.append(cur_data)
-
-        # Prepare GeoTIFF driver.
-        fmt = 'GTiff'
-        drv = gdal.GetDriverByName(fmt)
-        metadata = drv.GetMetadata()
-
-        # Check if driver supports Create() method.
-        if (gdal.DCAP_CREATE not in metadata) or (metadata[gdal.DCAP_CREATE] != 'YES'):
-            self.logger.error('''Error!
-                      Driver %s does not support Create() method.
-                      Unable to write GeoTIFF.''', fmt)
-            raise AssertionError
+            band_lon_splits.extend([lon_split] * (1 if cur_data.ndim == 2 else cur_data.shape[0]))
 
         # Prepare file name
         filename = make_raw_filename(self._data_info, all_options)
@@ -268,21 +282,8 @@ class ImageGeotiff():
         if data_to_write.ndim == 2:
             data_to_write = np.expand_dims(data_to_write, 0)  # If it's 2-D make it 3-D
 
-        # Write image.
-        dims = data_to_write.shape
-        dataset = drv.Create(filename, dims[2], dims[1], dims[0], gdal.GDT_Float32)
-        if dataset is None:
-            self.logger.error('Error creating file: %s. Check the output path! Aborting...', filename)
-            raise FileNotFoundError("Can't write file!")
-        band = 0
-        for data_slice in data_to_write:
-            band += 1
-            dataset.GetRasterBand(band).WriteArray(data_slice)
-
-        # Prepare geokeys.
-        gtype = 'EPSG:4326'
-        cs = osr.GetWellKnownGeogCSAsWKT(gtype)
-        dataset.SetProjection(cs)
+        # Prepare geokeys before the file is created, so bad grids don't leave a broken file behind.
+        cs = self._wkt_wgs84
 
         gt = [0, 1, 0, 0, 0, 1]  # Default value.
 
@@ -295,9 +296,29 @@ class ImageGeotiff():
         gt[0] = longitudes[0]
         gt[3] = latitudes[0]
 
-        dataset.SetGeoTransform(gt)
-
-        dataset = None
+        # Write image.
+        dims = data_to_write.shape
+        dataset = self._driver.Create(filename, dims[2], dims[1], dims[0], gdal.GDT_Float32,
+                                      options=GEOTIFF_CREATION_OPTIONS)
+        if dataset is None:
+            self.logger.error('Error creating file: %s. Check the output path! Aborting...', filename)
+            raise FileNotFoundError("Can't write file!")
+        try:
+            dataset.SetProjection(cs)
+            dataset.SetGeoTransform(gt)
+            for band, (data_slice, lon_split) in enumerate(zip(data_to_write, band_lon_splits), start=1):
+                raster_band = dataset.GetRasterBand(band)
+                # Write by strips of tiles' height, so each row of tiles is complete and can be compressed
+                # and flushed by GDAL before the next one, instead of keeping the whole band in the block cache.
+                for row in range(0, dims[1], GEOTIFF_BLOCK_SIZE):
+                    rows_slice = data_slice[row:row + GEOTIFF_BLOCK_SIZE]
+                    # Negative longitudes part goes to the left, the positive one (if split) goes to the right.
+                    raster_band.WriteArray(rows_slice[:, lon_split:], 0, row)
+                    if lon_split:
+                        raster_band.WriteArray(rows_slice[:, :lon_split], dims[2] - lon_split, row)
+            dataset.FlushCache()
+        finally:
+            dataset = None  # Closes the file.
 
         self.logger.info('Done!')
 
@@ -347,21 +368,25 @@ class ImageShape:
         with shapefile.Writer(filename) as shape_writer:
             if values.ndim == 1:  # 1-D values means we have stations without a time dimension
                 # Get stations with valid data only
-                valid_values = values[~values.mask]
-                valid_lon = options['longitudes'][~values.mask]
-                valid_lat = options['latitudes'][~values.mask]
-                valid_name = options['meta']['stations']['@names'][~values.mask]
-                valid_elevation = options['meta']['stations']['@elevations'][~values.mask]
-                valid_wmo_code = options['meta']['stations']['@wmo_codes'][~values.mask]
+                valid = ~np.ma.getmaskarray(values)
+                valid_values = np.ma.compressed(values)
+                valid_lon = np.compress(valid, options['longitudes'])
+                valid_lat = np.compress(valid, options['latitudes'])
+                valid_name = np.compress(valid, options['meta']['stations']['@names'])
+                valid_elevation = np.compress(valid, options['meta']['stations']['@elevations'])
+                valid_wmo_code = np.compress(valid, options['meta']['stations']['@wmo_codes'])
 
                 shape_writer.shapeType = shapefile.POINTZ
                 shape_writer.field('VALUE', 'N', decimal=8)
                 shape_writer.field('WMO_CODE', 'N', decimal=0)
                 shape_writer.field('NAME', 'C')
 
-                for i in range(len(valid_values)):
-                    shape_writer.pointz(valid_lon[i], valid_lat[i], z=valid_elevation[i])
-                    shape_writer.record(valid_values.data[i], valid_wmo_code[i], valid_name[i])
+                # Convert columns to Python lists at once instead of indexing arrays element by element.
+                for lon, lat, elevation, value, wmo_code, name in zip(valid_lon.tolist(), valid_lat.tolist(),
+                                                                      valid_elevation.tolist(), valid_values.tolist(),
+                                                                      valid_wmo_code.tolist(), valid_name.tolist()):
+                    shape_writer.pointz(lon, lat, z=elevation)
+                    shape_writer.record(value, wmo_code, name)
 
                 shape_writer.close()
 
@@ -3,26 +3,84 @@
 """
 from string import Template
 from datetime import datetime
+from glob import glob
 import re
 
 from copy import copy
-from netCDF4 import MFDataset, date2index, num2date, Dataset, MFTime
+from collections import OrderedDict
+from netCDF4 import MFDataset, date2num, num2date, Dataset, MFTime
 import numpy as np
 import numpy.ma as ma
 
 from core.base.common import listify, unlistify, decapitalize
 from .data import Data, GRID_TYPE_REGULAR, GRID_TYPE_IRREGULAR
 
-LONGITUDE_UNITS = {'degrees_east', 'degree_east', 'degrees_E', 'degree_E',
-                   'degreesE', 'degreeE', 'lon'}
-LATITUDE_UNITS = {'degrees_north', 'degree_north', 'degrees_N', 'degree_N',
-                  'degreesN', 'degreeN', 'lat'}
-TIME_UNITS = {'since', 'time'}
+LONGITUDE_UNITS = frozenset({'degrees_east', 'degree_east', 'degrees_E', 'degree_E',
+                             'degreesE', 'degreeE', 'lon'})
+LATITUDE_UNITS = frozenset({'degrees_north', 'degree_north', 'degrees_N', 'degree_N',
+                            'degreesN', 'degreeN', 'lat'})
+TIME_UNITS = frozenset({'since', 'time'})
+TIME_UNITS_RE = re.compile('|'.join(sorted(TIME_UNITS)))  # Matches units containing any of TIME_UNITS.
 NO_LEVEL_NAME = '-'
 WILDCARDS = {'year': '????', 'mm': '??', 'year1': '????', 'year2': '????', 'year1s-4': '????', 'year2s-4': '????', 'year1s1': '????', 'year2s1': '????'}
 DEFAULT_TIME_VAR_NAME = 'time'
 DEFAULT_LEVEL_VAR_NAME = 'level'
 DEFAULT_DATA_VAR_NAME = 'data'
+CHUNK_CACHE_SIZE = 64 * 2**20  # Total HDF5 chunk cache size (bytes) for a data variable in the files being read.
+CHUNK_CACHE_NELEMS = 1009  # Number of chunk slots in the cache. Should be a prime number.
+CHUNK_CACHE_PREEMPTION = 0.75
+TIME_UNIT_SECONDS = {'days': 86400, 'day': 86400, 'd': 86400, 'hours': 3600, 'hour': 3600, 'hrs': 3600, 'hr': 3600,
+                     'h': 3600, 'minutes': 60, 'minute': 60, 'mins': 60, 'min': 60, 'seconds': 1, 'second': 1,
+                     'secs': 1, 'sec': 1, 's': 1}
+GREGORIAN_REFORM_DATE = datetime(1582, 10, 15)  # Standard calendar is proleptic Gregorian only after this date.
+MFDATASET_CACHE_SIZE = 4  # Maximum number of simultaneously opened multifile datasets.
+AGGREGATION_DIMENSIONS = ('time', 'initial_time0_hours')  # Aggregation dimensions tried if files have no unlimited one.
+WRITE_COMPRESSION_LEVEL = 4  # zlib compression level of written data variables.
+WRITE_MAX_TILE_SIZE = 256  # Maximum number of nodes along each of lat and lon dimensions in a chunk of written data.
+WRITE_CHUNK_SIZE = 2**20  # Target size (bytes) of a chunk of written data.
+
+def _is_longitude_units(units):
+    """ Checks if units are longitude units. """
+    return units in LONGITUDE_UNITS
+
+def _is_latitude_units(units):
+    """ Checks if units are latitude units. """
+    return units in LATITUDE_UNITS
+
+def _is_time_units(units):
+    """ Checks if units are time units. """
+    return units is not None and TIME_UNITS_RE.search(units) is not None
+
+def _num2datetime(time_values, units):
+    """ Converts numeric time values into an array of datetime objects in the standard calendar.
+    Time steps after the Gregorian reform are converted with vectorized numpy datetime arithmetic,
+    other cases are left to netCDF4.num2date.
+
+    Arguments:
+        time_values -- 1-D array of time values
+        units -- time units ('<units> since <reference date>')
+
+    Returns:
+        time_grid -- array of datetime objects (cftime datetime objects for dates before the Gregorian reform)
+    """
+    time_values = np.asarray(time_values)
+    unit_seconds = TIME_UNIT_SECONDS.get(units.split(' since ')[0].strip().lower())
+    if unit_seconds is not None and time_values.size:
+        reference_date = num2date(0, units, only_use_cftime_datetimes=False)  # It's cftime datetime before the reform.
+        if isinstance(reference_date, datetime) and reference_date >= GREGORIAN_REFORM_DATE and time_values.min() >= 0:
+            offsets = np.rint(time_values.astype(np.float64) * (unit_seconds * 1e6)).astype('timedelta64[us]')
+            return (np.datetime64(reference_date, 'us') + offsets).astype(object)
+
+    return num2date(time_values, units, only_use_cftime_datetimes=False)
+
+def _filled_float32(values, fill_value):
+    """ Returns values as a float32 array with masked elements set to fill_value.
+    Only one float32 buffer is allocated, it's written to netCDF 'f4' variables without further conversion.
+    """
+    filled_values = np.array(ma.getdata(values), dtype=np.float32)
+    np.copyto(filled_values, np.float32(fill_value), where=ma.getmaskarray(values))
+    return filled_values
+
 
 class PercentTemplate(Template):
     """ Custom template for the string substitute method.
@@ -46,27 +104,239 @@ class DataNetcdf(Data):
         super().__init__(data_info)
         self._data_info = data_info
 
-        self.file_name_wildcard = ''
-        self.netcdf_root = None
+        self._netcdf_roots = OrderedDict()  # Opened multifile datasets by their file name wildcards (LRU order).
+        self._file_wildcards = {}  # File name wildcards by level names.
+        self._coordinates = {}  # Coordinate grids and variables of opened multifile datasets by their file name wildcards.
+        self._chunk_caches = {}  # Original chunk cache settings of enlarged files by their file name wildcards.
 
     def __del__(self):
-        if self.netcdf_root is not None:
-            self.netcdf_root.close()
+        if getattr(self, '_netcdf_roots', None):  # Nothing is opened if __init__ failed.
+            self.close()
+
+    def close(self):
+        """ Closes all opened multifile datasets.
+        """
+        for netcdf_root in self._netcdf_roots.values():
+            netcdf_root.close()
+        self._netcdf_roots = OrderedDict()
+        self._coordinates = {}
+        self._chunk_caches = {}
+
+    def _open_dataset(self, file_name_wildcard):
+        """ Opens a multifile dataset or takes it from opened ones.
+        The least recently used dataset is closed when too many datasets are opened.
+
+        Arguments:
+            file_name_wildcard -- wildcard-ed file name template
+
+        Returns:
+            netcdf_root -- opened multifile dataset
+        """
+        netcdf_root = self._netcdf_roots.pop(file_name_wildcard, None)
+        if netcdf_root is None:  # If this is the first time we see this wildcard...
+            # Files are globbed once and the list is passed to MFDataset, so retries don't search files again.
+            file_names = sorted(glob(file_name_wildcard))
+            if not file_names:
+                self.logger.error('Error! No files match \'%s\'. Aborting...', file_name_wildcard)
+                raise OSError('No files match {}'.format(file_name_wildcard))
+            aggdims = self._get_aggregation_dimensions(file_names[0])
+            for aggdim_num, aggdim in enumerate(aggdims, start=1):
+                try:
+                    netcdf_root = MFDataset(file_names, check=True, aggdim=aggdim)
+                    break
+                except OSError:
+                    if aggdim_num == len(aggdims):  # No more dimensions to try.
+                        raise
+        self._netcdf_roots[file_name_wildcard] = netcdf_root  # Most recently used goes to the end.
+        while len(self._netcdf_roots) > MFDATASET_CACHE_SIZE:
+            old_file_name_wildcard, old_netcdf_root = self._netcdf_roots.popitem(last=False)
+            old_netcdf_root.close()
+            self._coordinates.pop(old_file_name_wildcard, None)
+            self._chunk_caches.pop(old_file_name_wildcard, None)
+
+        return netcdf_root
+
+    def _get_aggregation_dimensions(self, file_name):
+        """ Returns aggregation dimensions to try when a multifile dataset is opened.
+        The unlimited dimension (None for MFDataset) goes first if the first file has one,
+        dimensions from AGGREGATION_DIMENSIONS absent in the file are skipped. Only the first file is opened.
+
+        Arguments:
+            file_name -- name of the first file of a dataset
+
+        Returns:
+            aggdims -- list of aggregation dimensions
+        """
+        with Dataset(file_name) as probe_root:
+            dimensions = probe_root.dimensions
+            aggdims = [None] if any(dim.isunlimited() for dim in dimensions.values()) else []
+            aggdims.extend(name for name in AGGREGATION_DIMENSIONS if name in dimensions)
+        if not aggdims:
+            aggdims = [None]  # Nothing fits, let MFDataset report the error.
+        return aggdims
+
+    def _get_file_wildcard(self, level_name):
+        """ Returns a wildcard-ed file name template of a level.
+        The template is substituted only once per level, subsequent calls return the stored wildcard.
+
+        Arguments:
+            level_name -- name of a vertical level
+
+        Returns:
+            file_name_wildcard -- file name template with keywords replaced by wildcards
+        """
+        file_name_wildcard = self._file_wildcards.get(level_name)
+        if file_name_wildcard is None:
+            file_name_template = self._data_info['data']['levels'][level_name]['@file_name_template']  # Template as in MDDB.
+            percent_template = PercentTemplate(file_name_template)  # Custom string template %keyword%.
+            file_name_wildcard = percent_template.substitute(WILDCARDS)  # Create wildcard-ed template
+            self._file_wildcards[level_name] = file_name_wildcard
+        return file_name_wildcard
+
+    def _set_chunk_cache(self, file_name_wildcard, data_variable, time_variable_name, time_idx_ranges):
+        """ Enlarges HDF5 chunk cache of a data variable in files of a multifile dataset overlapping time segments.
+        It keeps chunks covering the ROI in memory between consecutive reads. CHUNK_CACHE_SIZE is shared
+        by these files, and a file keeps its original cache if its share is not larger.
+        Files enlarged for previous reads but not overlapping the segments get their original cache back.
+
+        Arguments:
+            file_name_wildcard -- wildcard-ed file name template of the dataset
+            data_variable -- variable of a multifile dataset
+            time_variable_name -- name of the time variable (and dimension)
+            time_idx_ranges -- list of [start, end] time indices of the segments to read
+        """
+        try:
+            file_variables = data_variable._recVar  # Aggregated variable is split into files.  # pylint: disable=W0212
+            file_lengths = data_variable._recLen  # pylint: disable=W0212
+            aggregated_by_time = data_variable._recdimname == time_variable_name  # pylint: disable=W0212
+        except AttributeError:
+            file_variables = [data_variable]  # Non-aggregated variable is taken from the master file.
+            aggregated_by_time = False
+
+        if aggregated_by_time:
+            file_ends = np.cumsum(file_lengths) - 1  # Last time index in each file.
+            file_starts = file_ends - np.asarray(file_lengths) + 1  # First time index in each file.
+            file_indices = set()
+            for time_idx_start, time_idx_end in time_idx_ranges:
+                if time_idx_end >= time_idx_start:
+                    file_indices.update(np.flatnonzero((file_starts <= time_idx_end) & (file_ends >= time_idx_start)))
+        else:
+            file_indices = set(range(len(file_variables)))  # Files can't be matched to segments, all of them are read.
+
+        original_caches = self._chunk_caches.setdefault(file_name_wildcard, {})
+        for file_index in list(original_caches):
+            if file_index not in file_indices:
+                file_variables[file_index].set_var_chunk_cache(*original_caches.pop(file_index))
+
+        if not file_indices:
+            return
+        cache_size = CHUNK_CACHE_SIZE // len(file_indices)
+        for file_index in file_indices:
+            file_variable = file_variables[file_index]
+            chunking = file_variable.chunking()
+            if chunking is None or chunking == 'contiguous':  # Only chunked HDF5-based files have a chunk cache.
+                continue
+            original_cache = original_caches.get(file_index, file_variable.get_var_chunk_cache())
+            if cache_size > original_cache[0]:
+                if file_variable.get_var_chunk_cache()[0] != cache_size:  # Resetting the cache drops its chunks.
+                    file_variable.set_var_chunk_cache(size=cache_size, nelems=CHUNK_CACHE_NELEMS,
+                                                      preemption=CHUNK_CACHE_PREEMPTION)
+                original_caches[file_index] = original_cache
+            elif file_index in original_caches:
+                file_variable.set_var_chunk_cache(*original_caches.pop(file_index))
+
+    def _get_time_index_range(self, time_values, segment, time_units, time_calendar):
+        """ Searches a time segment in time values of a dataset.
+        As date2index's 'after' and 'before' did, the segment starts at the first time step after its beginning
+        and ends at the last time step before its ending, so time steps falling exactly on its bounds are left out.
+
+        Arguments:
+            time_values -- all (increasing) values of the time variable
+            segment -- time segment description
+            time_units -- units of the time variable
+            time_calendar -- calendar of the time variable
+
+        Returns:
+            time_idx_range -- [start, end] indices of the segment, end is less than start if the segment is empty
+        """
+        segment_start = datetime.strptime(segment['@beginning'], '%Y%m%d%H')
+        segment_end = datetime.strptime(segment['@ending'], '%Y%m%d%H')
+        segment_start_num, segment_end_num = date2num([segment_start, segment_end], time_units, time_calendar)
+        time_idx_start = int(np.searchsorted(time_values, segment_start_num, side='right'))
+        time_idx_end = int(np.searchsorted(time_values, segment_end_num, side='left')) - 1
+        return [time_idx_start, time_idx_end]
+
+    def _get_fill_value(self, data_variable):
+        """ Returns missing value of a data variable given by its attributes.
+
+        Arguments:
+            data_variable -- netCDF data variable
+
+        Returns:
+            fill_value -- value of '_FillValue' or 'missing_value' attribute, or None if both are absent
+        """
+        var_attrs_list = data_variable.ncattrs()
+        if '_FillValue' in var_attrs_list:
+            return data_variable._FillValue  # pylint: disable=W0212
+        if 'missing_value' in var_attrs_list:
+            return data_variable.missing_value
+        return None
 
     def _get_longitudes(self, nc_root):
-        longitude_variable = unlistify(nc_root.get_variables_by_attributes(units=lambda v: v in LONGITUDE_UNITS))
+        longitude_variable = unlistify(nc_root.get_variables_by_attributes(units=_is_longitude_units))
         lons = longitude_variable[:]
         if longitude_variable.ndim == 1:
             grid_type = GRID_TYPE_REGULAR
             if lons.max() > 180:
-                lons = ((lons + 180.0) % 360.0) - 180.0  # Switch from 0-360 to -180-180 grid
+                # Switch from 0-360 to -180-180 grid in place: lons are a fresh copy read from the file.
+                if not np.issubdtype(lons.dtype, np.floating):
+                    lons = lons.astype(float)
+                lons[lons >= 180.0] -= 360.0
         else:
             grid_type = GRID_TYPE_IRREGULAR
 
         return (lons, longitude_variable.name, grid_type)
 
+    def _get_time_variable(self, nc_root):
+        time_variable = unlistify(nc_root.get_variables_by_attributes(units=_is_time_units))
+        try:
+            calendar = time_variable.calendar
+        except AttributeError:
+            calendar = 'standard'
+        if len(nc_root._files) > 1:  # Skip if there only one file  # pylint: disable=W0212, E1101
+            time_variable = MFTime(time_variable, calendar=calendar)  # Apply multi-file support to the time variable
+
+        return time_variable
+
+    def _get_coordinates(self, file_name_wildcard, nc_root):
+        """ Returns coordinate grids and the time variable of a multifile dataset.
+        Variables are searched for by attributes (and the time variable is aggregated) only once per dataset,
+        so levels stored in the same files reuse them.
+
+        Arguments:
+            file_name_wildcard -- wildcard-ed file name template of the dataset
+            nc_root -- opened multifile dataset
+
+        Returns:
+            coordinates -- dictionary with keys:
+                ['longitudes'] -- (lons, longitude variable name, grid type)
+                ['latitudes'] -- (lats, latitude variable name, grid type)
+                ['time'] -- time variable
+                ['time_values'] -- all values of the time variable (increasing), to search time segments in
+        """
+        coordinates = self._coordinates.get(file_name_wildcard)
+        if coordinates is None:
+            time_variable = self._get_time_variable(nc_root)
+            coordinates = {'longitudes': self._get_longitudes(nc_root),
+                           'latitudes': self._get_latitudes(nc_root),
+                           'time': time_variable,
+                           'time_values': None if time_variable is None else np.asarray(time_variable[:])}
+            self._coordinates[file_name_wildcard] = coordinates
+
+        return coordinates
+
     def _get_latitudes(self, nc_root):
-        latitude_variable = unlistify(nc_root.get_variables_by_attributes(units=lambda v: v in LATITUDE_UNITS))
+        latitude_variable = unlistify(nc_root.get_variables_by_attributes(units=_is_latitude_units))
         lats = latitude_variable[:]
         if latitude_variable.ndim == 1:
             grid_type = GRID_TYPE_REGULAR
@@ -87,15 +357,15 @@ class DataNetcdf(Data):
                 # For reading data files where only one level is present, such as 'none', 'sfc', 'msl'...
                 level_index = 0
             else:
-                try:
-                # Little hack: convert level name from metadata database to float and back to string type
-                # to be able to search it correctly in float type level variable converted to string.
-                # Level variable is also primarily converted to float to 'synchronize' types.
-                    level_index = level_variable[:].astype('float').astype('str').tolist().index(str(float(re.findall(r'\d+', level_name)[0])))
-                except KeyError:
+                # Level name from metadata database contains a numeric level value (e.g., '500 hPa').
+                # Level variable is converted to float to 'synchronize' types and searched for this value.
+                level_value = float(re.findall(r'\d+', level_name)[0])
+                level_indices = np.flatnonzero(np.asarray(level_variable[:], dtype=float) == level_value)
+                if level_indices.size == 0:
                     self.logger.error('Level \'%s\' is not found in level variable \'%s\'. Aborting!',
                                       level_name, level_variable_name)
-                    raise
+                    raise ValueError
+                level_index = int(level_indices[0])
         else:
             level_index = None
 
@@ -114,60 +384,54 @@ class DataNetcdf(Data):
         """
 
         self.logger.info('Reading NetCDF data...')
-        if self._data_info['data']['@type'] == 'dataset':
+        data_info = self._data_info['data']
+        variable_name = data_info['variable']['@name']
+        if data_info['@type'] == 'dataset':
             self.logger.info('[Dataset: %s, resolution: %s, scenario: %s, time_step: %s]',
-                             self._data_info['data']['dataset']['@name'], self._data_info['data']['dataset']['@resolution'],
-                             self._data_info['data']['dataset']['@scenario'], self._data_info['data']['dataset']['@time_step']
+                             data_info['dataset']['@name'], data_info['dataset']['@resolution'],
+                             data_info['dataset']['@scenario'], data_info['dataset']['@time_step']
                             )
-        if self._data_info['data']['@type'] == 'raw':
+        if data_info['@type'] == 'raw':
             self.logger.info('[File: %s, type: %s]',
-                             self._data_info['data']['file']['@name'], self._data_info['data']['file']['@type'])
-        self.logger.info('[Variable: %s]', self._data_info['data']['variable']['@name'])
+                             data_info['file']['@name'], data_info['file']['@type'])
+        self.logger.info('[Variable: %s]', variable_name)
 
         # Levels must be a list or None.
         levels_to_read = listify(options['levels'])
         if levels_to_read is None:
-            levels_to_read = listify(self._data_info['data']['levels']['@values'])  # Read all levels if nothing specified.
+            levels_to_read = listify(data_info['levels']['@values'])  # Read all levels if nothing specified.
         # Segments must be a list or None.
         segments_to_read = listify(options['segments'])
         if segments_to_read is None:
-            segments_to_read = listify(self._data_info['data']['time']['segment'])  # Read all levels if nothing specified.
+            segments_to_read = listify(data_info['time']['segment'])  # Read all levels if nothing specified.
 
         variable_indices = {}  # Contains lists of indices for each dimension of the data variable in the domain to read.
 
         self._make_ROI()
 
+        # ERA Interim total precipitation is accumulated within forecasts, it's fixed after reading.
+        is_eraint_tp = data_info['@type'] == 'dataset' and data_info['dataset']['@name'].lower() == 'eraint' and \
+            variable_name.lower() == 'tp'
+
         # Process each vertical level separately.
         for level_name in levels_to_read:
             dd = [] # Data variable's dimensions list.
 
             self.logger.info('Vertical level: \'%s\'', level_name)
-            level_variable_name = self._data_info['data']['levels'][level_name]['@level_variable_name']
+            level_info = data_info['levels'][level_name]
+            level_variable_name = level_info['@level_variable_name']
 
-            data_scale = self._data_info['data']['levels'][level_name]['@scale']
-            data_offset = self._data_info['data']['levels'][level_name]['@offset']
+            data_scale = level_info['@scale']
+            data_offset = level_info['@offset']
 
-            file_name_template = self._data_info['data']['levels'][level_name]['@file_name_template']  # Template as in MDDB.
-            percent_template = PercentTemplate(file_name_template)  # Custom string template %keyword%.
-            file_name_wildcard = percent_template.substitute(WILDCARDS)  # Create wildcard-ed template
+            file_name_wildcard = self._get_file_wildcard(level_name)
 
-            # Kind of a caching for netcdf_root to save time working at the same vertical level.
+            # Opened datasets are cached by wildcard, so levels stored in the same files are opened only once.
             self.logger.info('Open files...')
-            if self.file_name_wildcard != file_name_wildcard:  # If this is the first time we see this wildcard...
-                try:
-                    netcdf_root = MFDataset(file_name_wildcard, check=True)
-                except OSError:
-                    try:
-                        netcdf_root = MFDataset(file_name_wildcard, check=True, aggdim='time')
-                    except OSError:
-                        netcdf_root = MFDataset(file_name_wildcard, check=True, aggdim='initial_time0_hours')
-                self.file_name_wildcard = file_name_wildcard  # we store wildcard...
-                self.netcdf_root = netcdf_root                # and netcdf_root.
-            else:
-                netcdf_root = self.netcdf_root  # Otherwise we take its "stored value".
+            netcdf_root = self._open_dataset(file_name_wildcard)
             self.logger.info('Done!')
 
-            data_variable = netcdf_root.variables[self._data_info['data']['variable']['@name']]  # Data variable. pylint: disable=E1136
+            data_variable = netcdf_root.variables[variable_name]  # Data variable. pylint: disable=E1136
             data_variable.set_auto_mask(False)
 
             self.logger.info('Get grids...')
@@ -178,28 +442,26 @@ class DataNetcdf(Data):
                 variable_indices[level_variable_name] = [level_index]
                 dd.append(level_variable_name)
 
+            coordinates = self._get_coordinates(file_name_wildcard, netcdf_root)
+
             # Determine indices of latitudes.
-            lats, latitude_variable_name, lat_grid_type = self._get_latitudes(netcdf_root)
+            lats, latitude_variable_name, lat_grid_type = coordinates['latitudes']
             if lat_grid_type == GRID_TYPE_REGULAR:  # For regular grid we will read only rectangular area bounding ROI.
-                latitude_indices = np.nonzero([ge and le for ge, le in
-                                               zip(lats >= self._ROI_bounds['min_lat'], 
-                                                   lats <= self._ROI_bounds['max_lat'])])[0]
+                latitude_indices = self._get_ROI_indices(lats, self._ROI_bounds['min_lat'], self._ROI_bounds['max_lat'])
                 latitude_grid = lats[latitude_indices]
             else:
-                latitude_indices = np.arange(lats.shape[-2])  # For irregular grids we will read the WHOLE area.
+                latitude_indices = np.arange(lats.shape[-2])  # For irregular grids the area is restricted below.
                 latitude_grid = lats[:]
             variable_indices[latitude_variable_name] = latitude_indices
             dd.append(latitude_variable_name)
 
             # Determine indices of longitudes.
-            lons, longitude_variable_name, lon_grid_type = self._get_longitudes(netcdf_root)
+            lons, longitude_variable_name, lon_grid_type = coordinates['longitudes']
             if lon_grid_type == GRID_TYPE_REGULAR:  # For regular grid we will read only rectangular area bounding ROI.
-                longitude_indices = np.nonzero([ge and le for ge, le in
-                                                zip(lons >= self._ROI_bounds['min_lon'], 
-                                                    lons <= self._ROI_bounds['max_lon'])])[0]
+                longitude_indices = self._get_ROI_indices(lons, self._ROI_bounds['min_lon'], self._ROI_bounds['max_lon'])
                 longitude_grid = lons[longitude_indices]
             else:
-                longitude_indices = np.arange(lons.shape[-1])  # For irregular grids we will read the WHOLE area.
+                longitude_indices = np.arange(lons.shape[-1])  # For irregular grids the area is restricted below.
                 longitude_grid = lons[:]
             variable_indices[longitude_variable_name] = longitude_indices
             dd.append(longitude_variable_name)
@@ -211,6 +473,16 @@ class DataNetcdf(Data):
                 self.logger.error('Error! Longitude and latitude grids are not match! Aborting.')
                 raise ValueError
 
+            # For irregular grids we will read only rows and columns bounding grid nodes within the ROI bounding box.
+            if grid_type == GRID_TYPE_IRREGULAR:
+                latitude_indices, longitude_indices = self._get_ROI_box_indices(lons, lats)
+                box_slices = (slice(latitude_indices[0], latitude_indices[-1] + 1),
+                              slice(longitude_indices[0], longitude_indices[-1] + 1))
+                latitude_grid = lats[box_slices]
+                longitude_grid = lons[box_slices]
+                variable_indices[latitude_variable_name] = latitude_indices
+                variable_indices[longitude_variable_name] = longitude_indices
+
             # A small temporary hack.
             # TODO: Dataset DS131, T62 grid variables has a dimension 'forecast_time1'. Now I set it
             # to the first element (whatever it is), but in the future it somehow should be selected by a user
@@ -219,14 +491,7 @@ class DataNetcdf(Data):
                 variable_indices['forecast_time1'] = [0]
                 dd.insert(0, 'forecast_time1')
 
-            time_variable = unlistify(netcdf_root.get_variables_by_attributes(
-                units=lambda v: True in [tu in v for tu in TIME_UNITS] if v is not None else False))
-            try:
-                calendar = time_variable.calendar
-            except AttributeError:
-                calendar = 'standard'
-            if len(netcdf_root._files) > 1:  # Skip if there only one file  # pylint: disable=W0212, E1101
-                time_variable = MFTime(time_variable, calendar=calendar)  # Apply multi-file support to the time variable
+            time_variable = coordinates['time']
             if time_variable is not None:
                 dd.insert(0, time_variable._name) # pylint: disable=W0212, E1101
 
@@ -234,24 +499,36 @@ class DataNetcdf(Data):
 
             # Create ROI mask.
             ROI_mask = self._make_ROI_mask(longitude_grid, latitude_grid)
+            ROI_masks_nothing = not ROI_mask.any()  # The whole area read is within the ROI.
+
+            # Missing value is taken from data variable attributes once per level, it's guessed from data otherwise.
+            variable_fill_value = self._get_fill_value(data_variable)
+            variable_has_units = 'units' in data_variable.ncattrs()
+
+            # Attributes of the variables are the same for all segments, so they are taken once.
+            n_dims = data_variable.ndim
+            time_variable_name = time_variable._name  # pylint: disable=W0212, E1101
+            time_units = time_variable.units  # pylint: disable=E1101
+            time_calendar = getattr(time_variable, 'calendar', 'standard')
+
+            # Time indices of all segments are found first, so the chunk cache is enlarged only in files read.
+            time_idx_ranges = [self._get_time_index_range(coordinates['time_values'], segment, time_units, time_calendar)
+                               for segment in segments_to_read]
+            self._set_chunk_cache(file_name_wildcard, data_variable, time_variable_name, time_idx_ranges)
 
             # Process each time segment separately.
             self._init_segment_data(level_name)  # Initialize a data dictionary for the vertical level 'level_name'.
-            for segment in segments_to_read:
+            for segment, time_idx_range in zip(segments_to_read, time_idx_ranges):
                 self.logger.info('Time segment \'%s\' (%s-%s)',
                                  segment['@name'], segment['@beginning'], segment['@ending'])
 
-                segment_start = datetime.strptime(segment['@beginning'], '%Y%m%d%H')
-                segment_end = datetime.strptime(segment['@ending'], '%Y%m%d%H')
-                time_idx_start = date2index(segment_start, time_variable, select='after')
-                time_idx_end = date2index(segment_end, time_variable, select='before')
-                time_idx_range = [time_idx_start, time_idx_end]
                 if time_idx_range[1] < time_idx_range[0]:
-                    self.logger.error('Error! The end of the time segment is before the first time in the dataset. Aborting!')
+                    self.logger.error('Error! There are no time steps of the dataset within the time segment. Aborting!')
                     raise ValueError
-                variable_indices[time_variable._name] = np.arange(time_idx_range[0], time_idx_range[1]+1)  # pylint: disable=W0212, E1101
-                time_values = time_variable[variable_indices[time_variable._name]]  # Raw time values.  # pylint: disable=W0212, E1101
-                time_grid = num2date(time_values, time_variable.units)  # Time grid as a datetime object.  # pylint: disable=E1101
+                # Time indices are contiguous, so keep them as a range and read time values as a single slice.
+                variable_indices[time_variable_name] = range(time_idx_range[0], time_idx_range[1]+1)
+                time_values = coordinates['time_values'][time_idx_range[0]:time_idx_range[1]+1]  # Raw time values.
+                time_grid = _num2datetime(time_values, time_units)  # Time grid as datetime objects.
 
                 # Searching for a gap in longitude indices. Normally all steps should be equal to 1.
                 # If there is a step longer than 1, we suppose it's a gap due to a shift from 0-360 to -180-180 grid.
@@ -262,10 +539,10 @@ class DataNetcdf(Data):
                 # Thus we will have a single data patch with the uniform logitude grid.
                 lon_gap_mode = False  # Normal mode.
                 if grid_type == GRID_TYPE_REGULAR:
-                    for i in range(len(variable_indices[longitude_variable_name])-1):
-                        if variable_indices[longitude_variable_name][i+1]-variable_indices[longitude_variable_name][i] > 1:
-                            lon_gap_mode = True  # Gap mode! Set the flag! :)
-                            lon_gap_position = i  # Index of the gap.
+                    lon_gaps = np.flatnonzero(np.diff(variable_indices[longitude_variable_name]) > 1)
+                    if lon_gaps.size:
+                        lon_gap_mode = True  # Gap mode! Set the flag! :)
+                        lon_gap_position = lon_gaps[-1]  # Index of the gap.
 
                 # Get start (first) and stop (last) indices for each dimension.
                 start_index = [variable_indices[dd[i]][0] for i in range(len(dd))]
@@ -280,14 +557,14 @@ class DataNetcdf(Data):
                     start_index_2[lon_index_pos] = \
                         variable_indices[longitude_variable_name][lon_gap_position+1]  # Second part starts here.
 
-                # Here we actually read the data array from the file for all lons and lats (it's faster to read everything).
+                # Here we actually read the data array from the file: a single hyperslab bounding the ROI (not the whole grid).
                 # And mask all points outside the ROI mask for all times.
                 self.logger.info('Actually reading...')
-                slices = tuple([slice(start_index[i], stop_index[i]) for i in range(data_variable.ndim)])
+                slices = tuple([slice(start_index[i], stop_index[i]) for i in range(n_dims)])
                 data_slice = data_variable[slices]
                 if lon_gap_mode:
                     self.logger.info('[Gap mode] Reading the second data part...')
-                    slices_2 = tuple([slice(start_index_2[i], stop_index_2[i]) for i in range(data_variable.ndim)])
+                    slices_2 = tuple([slice(start_index_2[i], stop_index_2[i]) for i in range(n_dims)])
                     data_slice_2 = data_variable[slices_2]
                 self.logger.info('Done!')
 
@@ -309,38 +586,28 @@ class DataNetcdf(Data):
                 #  We make them to be: tp@3h, tp@9h, tp@15h, tp@21h...
                 # Originally 3h-step data are stored as: tp@3h, tp@3h+tp@6h, tp@3h+tp@6h+tp@9h, tp@15h, tp@15h+tp@18h, tp@15h+tp@18h+tp@21h...
                 #  We make them to be: tp@3h, tp@6h, tp@9h, tp@15h, tp@18h, tp@21h... (note: there is no tp@12h in the time grid!)
-                if self._data_info['data']['@type'] == 'dataset':
-                    if self._data_info['data']['dataset']['@name'].lower() == 'eraint' and \
-                        self._data_info['data']['variable']['@name'].lower() == 'tp':
-                        if self._data_info['data']['dataset']['@time_step'] == '6h':
-                            for i in range(0, len(time_grid)-1, 2):
-                                data_slice[i+1] -= data_slice[i]
-                        elif self._data_info['data']['dataset']['@time_step'] == '3h':
-                            for i in range(0, len(time_grid)-2, 2):
-                                data_slice[i+2] -= data_slice[i+1]
-                                data_slice[i+1] -= data_slice[i]
-                        else:
-                            self.logger.error('Error! Unsupported time step \'%s\'. Aborting...',
-                                              self._data_info['data']['dataset']['@time_step'])
-                            raise ValueError
-                        # And, since negative values in total precipitation look weird (IMHO), let's fix them also.
-                        data_slice[np.where(data_slice < 0)] = 0.0
+                if is_eraint_tp:
+                    if data_info['dataset']['@time_step'] == '6h':
+                        for i in range(0, len(time_grid)-1, 2):
+                            data_slice[i+1] -= data_slice[i]
+                    elif data_info['dataset']['@time_step'] == '3h':
+                        for i in range(0, len(time_grid)-2, 2):
+                            data_slice[i+2] -= data_slice[i+1]
+                            data_slice[i+1] -= data_slice[i]
+                    else:
+                        self.logger.error('Error! Unsupported time step \'%s\'. Aborting...',
+                                          data_info['dataset']['@time_step'])
+                        raise ValueError
+                    # And, since negative values in total precipitation look weird (IMHO), let's fix them also.
+                    data_slice[np.where(data_slice < 0)] = 0.0
 
                 # Create masked array using ROI mask.
                 self.logger.info('Creating masked array...')
-                # TODO: Are we sure that the last two dimensions are lat and lon correspondingly?
-                if data_slice.ndim > 2:  # When time dimension is present.
-                    ROI_mask_time = np.tile(ROI_mask, (time_grid.size, 1, 1))  # Propagate ROI mask along the time dimension.
-                else:                   # When there is only lat and lon dimensions are present.
-                    ROI_mask_time = ROI_mask
 
                 # Get/guess missing value from the data variable
-                var_attrs_list = data_variable.ncattrs()
-                if '_FillValue' in var_attrs_list:
-                    fill_value = data_variable._FillValue     # pylint: disable=W0212
-                elif 'missing_value' in var_attrs_list:
-                    fill_value = data_variable.missing_value
-                elif 'units' in var_attrs_list:
+                if variable_fill_value is not None:
+                    fill_value = variable_fill_value
+                elif variable_has_units:
                     self.logger.info('No missing value attribute. Trying to guess...')
                     if data_slice.min() >= 0.0 - 1e12 and data_slice.min() <= 0.0 + 1e12 and data_variable.units == 'K':
                         fill_value = data_slice.min()
@@ -352,16 +619,30 @@ class DataNetcdf(Data):
                     self.logger.info('Can\'t get or guess missing value. Set to 1E20.')
                     fill_value = 1e20
 
-                fill_value_mask = data_slice == fill_value
-                combined_mask = ma.mask_or(fill_value_mask, ROI_mask_time, shrink=False)
+                # TODO: Are we sure that the last two dimensions are lat and lon correspondingly?
+                # ROI mask is broadcast along the time dimension (if present) instead of being tiled.
+                if np.isnan(fill_value):  # NaN is not equal to itself, so NaN fill values are searched explicitly.
+                    combined_mask = np.isnan(data_slice)
+                else:
+                    combined_mask = data_slice == fill_value
+                if not ROI_masks_nothing:  # Otherwise only fill values are masked.
+                    np.logical_or(combined_mask, ROI_mask, out=combined_mask)
 
                 masked_data_slice = ma.MaskedArray(data_slice, mask=combined_mask, fill_value=fill_value)
                 #self.logger.info('Min data value: %s, max data value: %s', masked_data_slice.min(), masked_data_slice.max())
                 self.logger.info('Done!')
 
                 # Apply scale/offset from the MDDB.
+                # Values are scaled in a single buffer, and masked elements keep their original values,
+                # as they do in masked array arithmetic. The buffer type is set explicitly, so it doesn't depend
+                # on NumPy's promotion rules: floating data keeps its type, packed integer data becomes float64.
                 self.logger.info('Applying scale/offset from the MDDB....')
-                masked_data_slice = masked_data_slice * data_scale + data_offset
+                scaled_dtype = data_slice.dtype if np.issubdtype(data_slice.dtype, np.floating) else np.dtype(np.float64)
+                scaled_data_slice = np.multiply(data_slice, data_scale, dtype=scaled_dtype)
+                np.add(scaled_data_slice, data_offset, out=scaled_data_slice)
+                np.copyto(scaled_data_slice, data_slice, where=combined_mask)
+                masked_data_slice = ma.MaskedArray(scaled_data_slice, mask=combined_mask,
+                                                   fill_value=masked_data_slice.fill_value)
                 self.logger.info('Done!')
 
                 # If time grid contains only 1 element, data slice does not have this dimension due to np.squeeze.
@@ -379,10 +660,10 @@ class DataNetcdf(Data):
             pass
 
         # Get data description from metadata database for a dataset.
-        if self._data_info['data']['@type'] == 'dataset':
-            data_description = self._data_info['data']['description']
+        if data_info['@type'] == 'dataset':
+            data_description = data_info['description']
         # Get data description from a netcdf file metadata if not present.
-        if self._data_info['data']['@type'] == 'raw' and 'description' not in self._data_info['data'].keys():
+        if data_info['@type'] == 'raw' and 'description' not in data_info.keys():
             data_description = {}
             data_description['@title'] = netcdf_root.Title
             data_description['@name'] = data_variable.long_name
@@ -396,6 +677,25 @@ class DataNetcdf(Data):
 
         return self._get_result_data()
 
+    def _get_write_chunk_sizes(self, n_times, n_lat, n_lon):
+        """ Returns chunk sizes for a written (time, level, lat, lon) data variable.
+        Chunks cover a single level and a lat-lon tile. Time extent of a chunk grows until the chunk reaches
+        WRITE_CHUNK_SIZE, so time series at a grid node are read with only a few chunks.
+
+        Arguments:
+            n_times -- number of time steps
+            n_lat -- number of latitudes
+            n_lon -- number of longitudes
+
+        Returns:
+            chunk_sizes -- chunk sizes along (time, level, lat, lon) dimensions
+        """
+        lat_chunk = min(n_lat, WRITE_MAX_TILE_SIZE)
+        lon_chunk = min(n_lon, WRITE_MAX_TILE_SIZE)
+        time_chunk = min(n_times, max(1, WRITE_CHUNK_SIZE // (4 * lat_chunk * lon_chunk)))  # 4 bytes per float.
+
+        return (time_chunk, 1, lat_chunk, lon_chunk)
+
     def write(self, all_values, all_options):
         """Writes data array into a netCDF file.
 
@@ -580,13 +880,17 @@ class DataNetcdf(Data):
 
         # Define data variable dimensions.
         data_dims = [time_var_name, level_var_name, 'nlat', 'nlon']
+        chunk_sizes = self._get_write_chunk_sizes(n_times, n_lat, n_lon)
         data_num = 0
         # Check if data variable is present in the file.
         data_var = root.variables.get(varname)
         while True:
             if data_var is None:
                 # Define a new variable.
-                data_var = root.createVariable(varname, 'f4', data_dims, fill_value=values.fill_value)
+                # Compression and chunking are ignored by netCDF4 if an existing netCDF-3 file is appended.
+                data_var = root.createVariable(varname, 'f4', data_dims, fill_value=values.fill_value,
+                                               zlib=True, complevel=WRITE_COMPRESSION_LEVEL, shuffle=True,
+                                               chunksizes=chunk_sizes)
                 break
             data_num += 1  # Or create a new name and check it out also.
             varname = DEFAULT_DATA_VAR_NAME + str(data_num)
@@ -595,9 +899,14 @@ class DataNetcdf(Data):
         data_var.units = all_options['description']['@units']
         data_var.long_name = all_options['description']['@title']
         data_var.original_data = all_options['description']['@name']
-        # Write data variable.
+        # Write data variable by blocks of whole chunks along the time dimension.
+        # Each block is compressed and written at once, and only a block-sized float32 buffer is allocated.
+        time_block = chunk_sizes[0]
         for level_idx in range(n_levels):
-            data_var[:, level_idx, :, :] = ma.filled(values[level_idx, :, :, :], fill_value=values.fill_value)  # Write values.
+            for time_start in range(0, n_times, time_block):
+                time_slice = slice(time_start, time_start + time_block)
+                data_var[time_slice, level_idx, :, :] = _filled_float32(values[level_idx, time_slice, :, :],
+                                                                       values.fill_value)  # Write values.
 
         root.close()
         self.logger.info('Done!')
@@ -627,7 +936,8 @@ class DataNetcdf(Data):
         # Define dimensions.
         lon = root.createDimension('lon', options['longitudes'].size)  # pylint: disable=W0612
         lat = root.createDimension('lat', options['latitudes'].size)  # pylint: disable=W0612
-        station = root.createDimension('station', options['meta']['stations']['@names'].size)  # pylint: disable=W0612
+        n_stations = options['meta']['stations']['@names'].size
+        station = root.createDimension('station', n_stations)  # pylint: disable=W0612
 
         # Get time values.
         time_grid = [item for sublist in options['times'] for item in sublist]
@@ -651,10 +961,15 @@ class DataNetcdf(Data):
         longitudes = root.createVariable('lon', 'f4', ('lon'))
 
         if n_times > 1:
-            data = root.createVariable('data', 'f4', ('time', 'station'), fill_value=values.fill_value)
+            # Chunks hold all stations and as many time steps as fit into WRITE_CHUNK_SIZE.
+            time_chunk = min(n_times, max(1, WRITE_CHUNK_SIZE // (4 * max(n_stations, 1))))  # 4 bytes per float.
+            data = root.createVariable('data', 'f4', ('time', 'station'), fill_value=values.fill_value,
+                                       zlib=True, complevel=WRITE_COMPRESSION_LEVEL, shuffle=True,
+                                       chunksizes=(time_chunk, max(n_stations, 1)))
             coordinates = 'time lat lon alt'
         else:
-            data = root.createVariable('data', 'f4', ('station'), fill_value=values.fill_value)
+            data = root.createVariable('data', 'f4', ('station'), fill_value=values.fill_value,
+                                       zlib=True, complevel=WRITE_COMPRESSION_LEVEL, shuffle=True)
             coordinates = 'lat lon alt'
         station_name = root.createVariable('station_name', str, ('station'), fill_value=values.fill_value)
         wmo_code = root.createVariable('wmo_code', 'f4', ('station'), fill_value=values.fill_value)
@@ -689,7 +1004,14 @@ class DataNetcdf(Data):
             time_var[:] = [(cur_date - start_date).days for cur_date in time_grid]
         longitudes[:] = options['longitudes']
         latitudes[:] = options['latitudes']
-        data[:] = ma.filled(values, fill_value=values.fill_value)
+        filled_values = _filled_float32(values, values.fill_value)  # Values of stations (1-D).
+        if n_times > 1:
+            # Values of stations are written at each time step. It's done by blocks of whole chunks
+            # along the time dimension, so the broadcasted buffer doesn't grow with the number of time steps.
+            for time_start in range(0, n_times, time_chunk):
+                data[time_start:time_start + time_chunk] = filled_values
+        else:
+            data[:] = filled_values
         station_name[:] = options['meta']['stations']['@names']
         wmo_code[:] = options['meta']['stations']['@wmo_codes']
         alt[:] = options['meta']['stations']['@elevations']
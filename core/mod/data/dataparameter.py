@@ -4,6 +4,8 @@
 from core.base.common import listify
 from .data import Data
 
+TYPE_CASTS = {'string': str, 'integer': int, 'float': float}  # Cast functions by parameter types.
+
 class DataParameter(Data):
     """ Provides methods for reading and writing parameters in a task file.
     """
@@ -20,15 +22,13 @@ class DataParameter(Data):
             cast_type -- type to cast to.
 
         Returns:
-            result -- scalar or list of scalars of the specified type.
+            result -- scalar or list of scalars of the specified type (None for unknown types).
         """
 
-        if cast_type == 'string':
-            return string_value
-        if cast_type == 'integer':
-            return int(string_value)
-        if cast_type == 'float':
-            return float(string_value)
+        type_cast = TYPE_CASTS.get(cast_type)
+        if type_cast is None:
+            return None
+        return type_cast(string_value)
 
     def read(self, options):    # pylint: disable=W0613
         """Reads parameters.
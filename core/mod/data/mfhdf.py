@@ -5,10 +5,13 @@ from collections.abc import Sequence
 from datetime import datetime
 
 import glob
+import re
 from pyhdf.SD import SD, SDC
 import numpy as np
 
-from core.base.common import list_remove_all, listify
+from core.base.common import listify
+
+LAYER_ATTRIBUTE_RE = re.compile(r'Layer (\d+)')  # Attributes 'Layer N' contain names of layers.
 
 
 def date2index(datetime_values, time_variable):
@@ -23,12 +26,36 @@ def date2index(datetime_values, time_variable):
         indices -- indices of the elements of the time_variable nearest to the datetime_values.
     '''
 
-    indices = []
-    for value in listify(datetime_values):
-        idx = np.searchsorted(time_variable, value, side='right')
-        indices.append(idx if (time_variable[idx] - value) < (value - time_variable[idx - 1]) else idx - 1)
+    values = np.asarray(listify(datetime_values))
+    if len(time_variable) == 1:
+        return [0] * values.size
+
+    # All values are searched at once. Indices are clipped so each value has both left and right neighbours,
+    # values outside the time grid get its first or last index.
+    right_indices = np.clip(np.searchsorted(time_variable, values, side='right'), 1, len(time_variable) - 1)
+    left_indices = right_indices - 1
+    is_right_nearer = (time_variable[right_indices] - values) < (values - time_variable[left_indices])
+    indices = np.where(is_right_nearer, right_indices, left_indices)
+
+    return indices.tolist()
+
+
+def _parse_datetime(date_string, time_string):
+    ''' Converts quoted metadata date and time values (e.g., '"2001-01-01"', '"00:00:00.000000"') into datetime.
+
+    Arguments:
+        date_string -- date value, YYYY-MM-DD.
+        time_string -- time value, HH:MM:SS with optional fraction of a second.
+
+    Result:
+        datetime_value -- datetime value.
+    '''
 
-    return indices
+    datetime_string = '{}T{}'.format(date_string.strip('"'), time_string.strip('"'))
+    try:
+        return datetime.fromisoformat(datetime_string)  # Fixed ISO layout is parsed without format matching.
+    except ValueError:  # Older Pythons accept only 3 or 6 digits of a fraction of a second here.
+        return datetime.strptime(datetime_string, '%Y-%m-%dT%H:%M:%S.%f')
 
 
 class MFDataset:
@@ -66,12 +93,16 @@ class MFDataset:
             elif datasets is None:
                 datasets = hdf_file.datasets()  # Get datasets info.
 
+            # Core metadata is parsed once per file and shared by the time and spatial grids.
+            coredict = self._get_metadata(hdf_file, 'CoreMetadata.0')
+
             # Read datetime range for each file (because it differs)
-            datetime_range.append(self._get_datetime_range(hdf_file))
+            datetime_range.append(self._get_datetime_range(coredict))
 
             # We read spatial grids only from the first file (should be the same for all files).
             if first_file:
-                spatial_grids = self._get_spatial_grids(hdf_file)
+                structdict = self._get_metadata(hdf_file, 'StructMetadata.0')
+                spatial_grids = self._get_spatial_grids(structdict, coredict)
                 self._longitudes = spatial_grids['longitudes']
                 self._latitudes = spatial_grids['latitudes']
                 first_file = False
@@ -80,98 +111,101 @@ class MFDataset:
         # Let's take the beginning of the range for each file to construct a time grid.
         self._times = [beginning for beginning, ending in datetime_range]
 
-        # Sort files by date and time.
-        sorter = np.argsort(self._times)
+        # Sort files by date and time. Times are sorted as datetime64 values to avoid comparing Python objects,
+        # but the time grid keeps datetime objects expected by readers and processing modules.
+        sorter = np.argsort(np.array(self._times, dtype='datetime64[us]'))
         self._files = [self._files[i] for i in sorter]
-        self._times = np.array([self._times[i] for i in sorter])
+        self._times = np.array(self._times, dtype=object)[sorter]
 
         for dataset_name in datasets.keys():
             self.variables[dataset_name] = Variable(dataset_name, self._files)
 
     def _meta_to_list(self, meta):
         ''' Convert metadata in string format into a list of key-value pairs.
-
-        Uses:
-            common.list_remove_all()
+        Lines are split in a single pass, keys and values are stripped, empty and 'END' lines are skipped.
 
         Arguments:
-            structmetadata -- a string with hierarchically organized HDF metadata
+            meta -- a string with hierarchically organized HDF metadata
 
-        Result: a list of key-value pairs
+        Result: a list of (key, value) pairs
         '''
 
-        list_ = meta.replace('\x00', '').split('\n')
-        list_ = list_remove_all(list_, 'END')
-        list_ = list_remove_all(list_, '')
+        pairlist = []
+        for line in meta.replace('\x00', '').split('\n'):
+            if line and line != 'END':
+                key, _, value = line.partition('=')
+                pairlist.append((key.strip(), value.strip()))
 
-        return [s.split('=', 1) for s in list_]
+        return pairlist
 
     def _list_to_dict(self, pairlist):
-        ''' Recursively converts a list of hierarchically organized key-value pairs into a dictionary.
+        ''' Converts a list of hierarchically organized key-value pairs into a dictionary.
+        Nested groups are tracked with a stack of enclosing dictionaries instead of recursion.
 
         Arguments:
-            pairlist -- list with key-value pairs.
+            pairlist -- list with stripped key-value pairs.
 
         Result:
             pairdict -- dictionary with key-value pairs.
         '''
 
         pairdict = {}
-        in_group = False
+        current_dict = pairdict
+        groups = []  # Stack of (group name, enclosing dictionary) of open groups.
 
         for key, value in pairlist:
-            key = key.strip()
-            value = value.strip()
-            if (key == 'GROUP' or key == 'OBJECT') and not in_group:
-                group_name = value
-                group_list = []
-                in_group = True
-            elif (key == 'END_GROUP' or key == 'END_OBJECT') and value == group_name:
-                pairdict[group_name] = self._list_to_dict(group_list)
-                in_group = False
-            elif in_group:
-                group_list.append([key, value])
+            if key in ('GROUP', 'OBJECT'):
+                groups.append((value, current_dict))
+                current_dict = {}
+            elif key in ('END_GROUP', 'END_OBJECT') and groups and value == groups[-1][0]:
+                group_name, enclosing_dict = groups.pop()
+                enclosing_dict[group_name] = current_dict
+                current_dict = enclosing_dict
             else:
-                pairdict[key] = value
+                current_dict[key] = value
 
         return pairdict
 
-    def _get_spatial_grids(self, file):
-        ''' Reads metadata from HDF file and returns longitude and latitude grids.
+    def _get_metadata(self, file, attribute_name):
+        ''' Reads a global metadata attribute from HDF file and parses it into a dictionary.
+
         Arguments:
             file -- HDF file handle.
+            attribute_name -- name of the attribute (e.g., 'CoreMetadata.0').
 
         Result:
-            spatial_grids -- dictionary {'longitude': longitude_grid, 'latitude': latitude_grid}.
+            metadict -- dictionary with hierarchically organized metadata.
         '''
 
-        spatial_grids = {}
+        index_meta = file.attr(attribute_name).index()
+        meta = file.attr(index_meta).get()
+        metalist = self._meta_to_list(meta)
 
-        # Get indices of global attributes.
-        index_struct_meta = file.attr('StructMetadata.0').index()
-        index_core_meta = file.attr('CoreMetadata.0').index()
+        return self._list_to_dict(metalist)
 
-        # The needed information is in a global attribute 'StructMetadata.0'.
-        structmeta = file.attr(index_struct_meta).get()
-        structlist = self._meta_to_list(structmeta)
-        structdict = self._list_to_dict(structlist)
+    def _get_spatial_grids(self, structdict, coredict):
+        ''' Returns longitude and latitude grids described by HDF file metadata.
+        Arguments:
+            structdict -- parsed global attribute 'StructMetadata.0' (dimensions).
+            coredict -- parsed global attribute 'CoreMetadata.0' (corners of the area).
 
-        # The additional needed information is in a global attribute 'CoreMetadata.0'.
-        coremeta = file.attr(index_core_meta).get()
-        corelist = self._meta_to_list(coremeta)
-        coredict = self._list_to_dict(corelist)
+        Result:
+            spatial_grids -- dictionary {'longitude': longitude_grid, 'latitude': latitude_grid}.
+        '''
+
+        spatial_grids = {}
 
         # Corners of the area
         spatial_container = coredict['INVENTORYMETADATA']['SPATIALDOMAINCONTAINER']
         bounding_rectangle = spatial_container['HORIZONTALSPATIALDOMAINCONTAINER']['BOUNDINGRECTANGLE']
-        lon0 = np.float(bounding_rectangle['WESTBOUNDINGCOORDINATE']['VALUE'])
-        lat0 = np.float(bounding_rectangle['NORTHBOUNDINGCOORDINATE']['VALUE'])
-        lon1 = np.float(bounding_rectangle['EASTBOUNDINGCOORDINATE']['VALUE'])
-        lat1 = np.float(bounding_rectangle['SOUTHBOUNDINGCOORDINATE']['VALUE'])
+        lon0 = float(bounding_rectangle['WESTBOUNDINGCOORDINATE']['VALUE'])
+        lat0 = float(bounding_rectangle['NORTHBOUNDINGCOORDINATE']['VALUE'])
+        lon1 = float(bounding_rectangle['EASTBOUNDINGCOORDINATE']['VALUE'])
+        lat1 = float(bounding_rectangle['SOUTHBOUNDINGCOORDINATE']['VALUE'])
 
         # Dimensions.
-        n_lon = np.int(structdict['GridStructure']['GRID_1']['XDim'])
-        n_lat = np.int(structdict['GridStructure']['GRID_1']['YDim'])
+        n_lon = int(structdict['GridStructure']['GRID_1']['XDim'])
+        n_lat = int(structdict['GridStructure']['GRID_1']['YDim'])
 
         # Steps.
         lon_inc = (lon1 - lon0) / n_lon
@@ -183,40 +217,34 @@ class MFDataset:
 
         return spatial_grids
 
-    def _get_datetime_range(self, file):
-        ''' Reads metadata from HDF file and returns a time range.
+    def _get_datetime_range(self, coredict):
+        ''' Returns a time range described by HDF file metadata.
 
         Arguments:
-            file -- HDF file handle.
+            coredict -- parsed global attribute 'CoreMetadata.0' containing datetime info.
 
         Result:
             datetime_range -- tuple, datetime range (begin, end).
         '''
 
-        # Get indexx of a global attribute CoreMetadata.0 containing datetime info.
-        index_core_meta = file.attr('CoreMetadata.0').index()
-        coremeta = file.attr(index_core_meta).get()
-        corelist = self._meta_to_list(coremeta)
-        coredict = self._list_to_dict(corelist)
-
         # Get date and time range values
         rangedatetime_container = coredict['INVENTORYMETADATA']['RANGEDATETIME']
-        date0_string = rangedatetime_container['RANGEBEGINNINGDATE']['VALUE']
-        time0_string = rangedatetime_container['RANGEBEGINNINGTIME']['VALUE']
-        if len(time0_string) > 10:
-            datetime0 = datetime.strptime(date0_string + time0_string, '"%Y-%m-%d""%H:%M:%S.%f"')
-        else:
-            datetime0 = datetime.strptime(date0_string + time0_string, '"%Y-%m-%d""%H:%M:%S"')
-        date1_string = rangedatetime_container['RANGEENDINGDATE']['VALUE']
-        time1_string = rangedatetime_container['RANGEENDINGTIME']['VALUE']
-        if len(time1_string) > 10:
-            datetime1 = datetime.strptime(date1_string + time1_string, '"%Y-%m-%d""%H:%M:%S.%f"')
-        else:
-            datetime1 = datetime.strptime(date1_string + time1_string, '"%Y-%m-%d""%H:%M:%S"')
+        datetime0 = _parse_datetime(rangedatetime_container['RANGEBEGINNINGDATE']['VALUE'],
+                                    rangedatetime_container['RANGEBEGINNINGTIME']['VALUE'])
+        datetime1 = _parse_datetime(rangedatetime_container['RANGEENDINGDATE']['VALUE'],
+                                    rangedatetime_container['RANGEENDINGTIME']['VALUE'])
         datetime_range = (datetime0, datetime1)
 
         return datetime_range
 
+    def close(self):
+        """ Closes all files of the dataset """
+        for variable in self.variables.values():
+            variable.close()
+        for hdf_file in self._files:
+            hdf_file.end()
+        self._files = []
+
     def get_longitude_variable(self):
         """ Returns longitude variable """
         return self._longitudes
@@ -238,8 +266,9 @@ class Variable(Sequence):
                                  'scale_factor', '_FillValue', 'units', 'add_offset', 'add_offset_err']
         self._dataset_name = dataset_name
         self._files = files
+        self._datasets = [None] * len(files)  # Selected datasets of the files, they are selected on first read.
 
-        dataset = files[0].select(dataset_name)
+        dataset = self._select(0)
         attributes = dataset.attributes()
 
         self.units = attributes['units']
@@ -250,15 +279,16 @@ class Variable(Sequence):
             self.dimensions.append(name.split(':')[0])
             self._shape.append(length)
         self.ndim = len(self.dimensions)
+        self._size = int(np.prod(self._shape))  # Number of elements, it's constant.
         self._FillValue = attributes['_FillValue']
-        layers = {int(key.split(' ')[1]): value for key, value in attributes.items() if key.find('Layer') != -1}
+        layer_matches = ((LAYER_ATTRIBUTE_RE.search(key), value) for key, value in attributes.items())
+        layers = {int(match.group(1)): value for match, value in layer_matches if match is not None}
         level_attributes = [k for k in attributes.keys() if k not in NOT_A_LEVEL_ATTRIBUTE]
         if not layers and len(level_attributes) > 4:  # No layers and many attributes means we have legend as attributes
             inv_attributes = {value: key for key, value in attributes.items() if not isinstance(value, list)}
             layers = {i: inv_attributes[i] for i in range(attributes['valid_range'][0], attributes['valid_range'][1] + 1)}
-        self._levels = np.array([None] * len(layers))
-
         if layers:  # Dataset contains layers
+            self._levels = np.empty(len(layers), dtype=object)  # Object arrays are created filled with None.
             for i, v in layers.items():
                 self._levels[i] = v
         else:
@@ -278,17 +308,41 @@ class Variable(Sequence):
             file_indices = key[0]  # We know it because we did it (see init)
             s = [int(key[i][0]) for i in range(1, len(key))]
             c = [len(key[i]) for i in range(1, len(key))]
-            data = []
-            for i in file_indices:
-                dataset = self._files[i].select(self._dataset_name)
-                data.append(dataset.get(start=s, count=c))
+            # Data of each file are put into a single array allocated on the first read, when their type is known.
+            data = None
+            for k, i in enumerate(file_indices):
+                file_data = self._select(i).get(start=s, count=c)
+                if data is None:
+                    data = np.empty((len(file_indices),) + file_data.shape, dtype=file_data.dtype)
+                data[k] = file_data
+            if data is None:  # No files to read.
+                data = np.array([])
         else:
             raise TypeError("Invalid argument type.")
 
-        return np.array(data)
+        return data
 
     def __len__(self):
-        return np.prod(self._shape)
+        return self._size
+
+    def _select(self, file_index):
+        """ Returns the dataset of a file selecting it only once.
+
+        Arguments:
+            file_index -- index of the file in the list of files.
+        """
+        dataset = self._datasets[file_index]
+        if dataset is None:
+            dataset = self._files[file_index].select(self._dataset_name)
+            self._datasets[file_index] = dataset
+        return dataset
+
+    def close(self):
+        """ Ends access to the selected datasets """
+        for dataset in self._datasets:
+            if dataset is not None:
+                dataset.endaccess()
+        self._datasets = [None] * len(self._files)
 
     def get_level_variable(self):
         """ Returns level variable """
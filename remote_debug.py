@@ -6,14 +6,15 @@ import sys
 
 import ptvsd
 
-sys.path.insert(0, './source')
-import run_core
-
 ptvsd.enable_attach(address=('localhost', 3000))
 
 #Enable the below line of code only if you want the application to wait untill the debugger has attached to it
 ptvsd.wait_for_attach()
 
+#The Core is imported after the debugger is attached, so its loading doesn't delay the attachment
+sys.path.insert(0, './source')
+import run_core
+
 #Let's sleep a second to synchronize with remote debugger
 time.sleep(1)
 
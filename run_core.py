@@ -7,12 +7,12 @@ import argparse
 import time
 import traceback
 
-import core
-
 def main(args):
     """Main function.
 
     It creates an instance of the MainApp class and runs the application."""
+    import core  # Imported here, so parsing arguments and attaching a debugger don't wait for the whole Core to load.
+
     print(core.__prog__ + ' v.' + core.__version__)
 
     start_time = time.time()
@@ -27,6 +27,8 @@ SAMPLE_INPUT = {'@dimensions': ['time', 'latitude', 'longitude'],
                                          '@units': 'K'}},
                 'meta': None}
 
+EXPECTED_VALUES = np.array([[261.]])
+
 
 class TimeMinTest(unittest.TestCase):
 
@@ -86,5 +88,5 @@ class TimeMinTest(unittest.TestCase):
 
         args, kwargs = data_helper.put.call_args_list[0]
 
-        self.assertTrue(all(a == b for a, b in zip(output_uids, args)))
-        self.assertTrue(kwargs['values'] == [[261.]])
+        self.assertEqual(list(args), output_uids)
+        np.testing.assert_array_equal(kwargs['values'], EXPECTED_VALUES)
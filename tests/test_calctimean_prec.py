@@ -37,6 +37,9 @@ SAMPLE_INPUT = {'@dimensions': ['time', 'latitude', 'longitude'],
                                          '@units': 'K'}},
                 'meta': None}
 
+EXPECTED_VALUES = np.array([[939]])
+
+
 class TimeMeanTest(unittest.TestCase):
 
     def _get(self, uid, segments=None, levels=None):
@@ -98,5 +101,5 @@ class TimeMeanTest(unittest.TestCase):
 
         args, kwargs = data_helper.put.call_args_list[0]
 
-        self.assertTrue(all(a == b for a, b in zip(output_uids, args)))
-        self.assertEqual(kwargs['values'], [[939]], msg='Got: {}'.format(kwargs['values']))
+        self.assertEqual(list(args), output_uids)
+        np.testing.assert_array_equal(kwargs['values'], EXPECTED_VALUES, err_msg='Got: {}'.format(kwargs['values']))
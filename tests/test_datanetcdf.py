@@ -0,0 +1,77 @@
+import unittest
+from unittest.mock import patch
+import os
+import tempfile
+import datetime
+import numpy as np
+import numpy.ma as ma
+from netCDF4 import Dataset
+
+from core.mod.data.datanetcdf import DataNetcdf
+
+STATION_VALUES = ma.MaskedArray(data=[261., 262., 263.], mask=[False, True, False], fill_value=-999.)
+STATION_META = {'stations': {'@names': np.array(['Tomsk', 'Omsk', 'Novosibirsk'], dtype=object),
+                             '@wmo_codes': np.array([29430, 28698, 29634]),
+                             '@elevations': np.array([141., 94., 162.])}}
+STATION_LONGITUDES = np.array([84.95, 73.40, 82.90])
+STATION_LATITUDES = np.array([56.50, 55.00, 55.03])
+SEGMENT = {'@name': 'Seg1', '@beginning': '1979010100', '@ending': '1979010318'}
+DESCRIPTION = {'@title': 'Weather stations', '@name': 'Air temperature', '@units': 'K'}
+
+
+class WriteStationsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.file_name = os.path.join(self.temp_dir.name, 'stations.nc')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _write(self, time_grid):
+        data_info = {'data': {'file': {'@name': self.file_name}}}
+        options = {'segment': [SEGMENT],
+                   'times': [time_grid],
+                   'longitudes': STATION_LONGITUDES,
+                   'latitudes': STATION_LATITUDES,
+                   'description': DESCRIPTION,
+                   'meta': STATION_META}
+        DataNetcdf(data_info).write([STATION_VALUES], options)
+
+    def test_stations_are_written_at_each_time_step(self):
+        time_grid = [datetime.datetime(1979, 1, day) for day in (1, 2)]
+        self._write(time_grid)
+
+        with Dataset(self.file_name) as root:
+            np.testing.assert_array_equal(root.variables['time'][:], [0, 1])
+            data = root.variables['data'][:]
+        self.assertEqual(data.shape, (len(time_grid), STATION_VALUES.size))
+        for time_values in data:
+            np.testing.assert_array_equal(time_values.data[~STATION_VALUES.mask],
+                                          STATION_VALUES.data[~STATION_VALUES.mask])
+            np.testing.assert_array_equal(ma.getmaskarray(time_values), STATION_VALUES.mask)
+
+    def test_stations_are_written_by_several_time_blocks(self):
+        time_grid = [datetime.datetime(1979, 1, day) for day in (1, 2, 3, 4, 5)]
+        with patch('core.mod.data.datanetcdf.WRITE_CHUNK_SIZE', 2 * 4 * STATION_VALUES.size):  # Two time steps.
+            self._write(time_grid)
+
+        with Dataset(self.file_name) as root:
+            data_variable = root.variables['data']
+            self.assertEqual(data_variable.chunking(), [2, STATION_VALUES.size])
+            data = data_variable[:]
+        self.assertEqual(data.shape, (len(time_grid), STATION_VALUES.size))
+        np.testing.assert_array_equal(ma.getmaskarray(data), np.tile(STATION_VALUES.mask, (len(time_grid), 1)))
+        np.testing.assert_array_equal(data.data[:, ~STATION_VALUES.mask],
+                                      np.tile(STATION_VALUES.data[~STATION_VALUES.mask], (len(time_grid), 1)))
+
+    def test_stations_of_a_single_time_step_are_written(self):
+        self._write([])
+
+        with Dataset(self.file_name) as root:
+            self.assertNotIn('time', root.variables)
+            data_variable = root.variables['data']
+            self.assertEqual(data_variable.measurement_time, '1979010100-1979010318')
+            data = data_variable[:]
+        np.testing.assert_array_equal(data.data[~STATION_VALUES.mask], STATION_VALUES.data[~STATION_VALUES.mask])
+        np.testing.assert_array_equal(ma.getmaskarray(data), STATION_VALUES.mask)